@@ -1,10 +1,14 @@
 import streamlit as st
 
 import os
+import time
 
 from handlers.data.PageConfig import PageConfig
 from handlers.data.LanguageLoader import LanguageLoader
 from handlers.data.SupabaseLoader import SupabaseLoader
+from handlers.data.HttpClient import get_http_client
+
+start_time = time.perf_counter()
 
 # Used so that the files are loaded on both a local machine and the cloud
 st.session_state.BASE_PATH = os.path.dirname(os.path.abspath(__file__))
@@ -22,6 +26,7 @@ else:
 page_config = PageConfig(version='V1.6.0')
 
 # Load the cloud database
+# - Shared across sessions, data is only loaded when a page first uses it
 if 'SUPABASE_CONNECTION' not in st.session_state:
     st.session_state.SUPABASE_CONNECTION = SupabaseLoader()
 
@@ -36,7 +41,10 @@ try:
         icon_image=st.session_state.BASE_PATH + '/resources/media/logo.png'
     )
     # Attempt to run the application pages
-    st.navigation(page_config.get_pages()).run()
+    page = st.navigation(page_config.get_pages())
+    page.run()
+    # Record the first paint time of each page for this session
+    st.session_state.setdefault('page_timings', {}).setdefault(page.title, f'{(time.perf_counter() - start_time) * 1000:.0f} ms')
 except AttributeError as e:
     st.warning(_('errors.general'), icon=':material/error:')
     st.error(e)
@@ -46,4 +54,6 @@ if st.context.url.startswith('http://localhost:'):
     '---'
     st.write('### '+(_('debugging.title')))
     st.json(dict(sorted(st.session_state.items())))
-    st.json(st.session_state.SUPABASE_CONNECTION.user)
\ No newline at end of file
+    st.json(st.session_state.SUPABASE_CONNECTION.user)
+    st.json(st.session_state.SUPABASE_CONNECTION.startup_timings)
+    st.json(get_http_client().stats())
\ No newline at end of file
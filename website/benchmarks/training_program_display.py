@@ -0,0 +1,124 @@
+# Time to build the Training Program grid, the original cell by cell loop versus TrainingProgram.display_frame
+# - Checks both give the same grid on a synthetic program, with and without year, period and week filters
+# - Run from website/: python benchmarks/training_program_display.py [--weeks 40] [--periods 4] [--repeat 20]
+import argparse
+import csv
+import datetime
+import io
+import pathlib
+import random
+import sys
+import time
+
+import pandas as pd
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+
+from handlers.data.TrainingProgram import TrainingProgram
+
+YEAR_GROUPS = ['Year 1', 'Year 2', 'Year 3', 'Year 4']
+CODES = ['DRL 1.2', 'NAV 2.1', 'AVS 1.3', 'Other', 'FLD 3.4', 'LDR 4.1', None]
+INSTRUCTORS = ['Cpl Smith', 'Sgt Jones', 'FLTLT Brown']
+
+
+def make_program(weeks: int, periods: int, seed: int = 1) -> TrainingProgram:
+    # A CSV grid in the layout of the stored programs, with some empty periods and weeks without a dress
+    rng = random.Random(seed)
+    start = datetime.date(2026, 2, 2)
+    rows = [
+        [None, None, *((start + datetime.timedelta(weeks=week)).strftime(TrainingProgram.DATE_FORMAT) for week in range(weeks))],
+        [None, None, *(rng.choice(['Blues', None]) for _ in range(weeks))],
+    ]
+    for year in YEAR_GROUPS:
+        for period in range(periods):
+            codes = [rng.choice(CODES) for _ in range(weeks)]
+            rows.append([year if period == 0 else None, f'Period {period + 1}', *codes])
+            rows.append([None, None, *(None if code is None else f'Lesson title {week}' for week, code in enumerate(codes))])
+            rows.append([None, None, *(None if code is None else rng.choice(INSTRUCTORS) for code in codes)])
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(['Year Group', 'Period', *(f'Week {week + 1}' for week in range(weeks))])
+    writer.writerows(rows)
+    return TrainingProgram.from_csv(output.getvalue().encode('utf-8'))
+
+
+def extend_rows(df, var_string, var, count):
+    if len(var) > 0:
+        selected_indices = df.index[df[var_string].isin(var)].tolist()
+        additional_indices = []
+        for idx in selected_indices:
+            additional_indices.extend(range(idx, min(idx + count, len(df))))
+        return df.loc[additional_indices]
+    return df
+
+
+def original(df: pd.DataFrame, years: list, periods: list, weeks: list) -> pd.DataFrame:
+    # The loop the Training Program page ran before display_frame
+    weeks = list(weeks)
+
+    df = extend_rows(df, 'Year Group', years, 3).reset_index(drop=True)
+    df = extend_rows(df, 'Period', periods, 3).reset_index(drop=True)
+
+    if len(weeks) > 0:
+        weeks.insert(0, 'Period')
+        weeks.insert(0, 'Year Group')
+        df = df[weeks]
+
+    rows_to_delete = []
+
+    for start in range(2, len(df), 3):
+        if start + 1 < len(df):
+            for col in df.columns:
+                df.loc[start, col] = f'{df.loc[start, col]} {df.loc[start + 1, col]}'.removesuffix(' nan')
+                if df.loc[start, col] == 'nan':
+                    df.loc[start, col] = ''
+            rows_to_delete.append(start + 1)
+
+    df = df.drop(index=rows_to_delete).reset_index(drop=True)
+
+    df.fillna(' ', inplace=True)
+
+    year_group_indices = {year: df.index[df['Year Group'] == year].tolist() for year in df['Year Group'].unique()}
+    year_group_indices.pop(' ')
+    for indices in year_group_indices:
+        for idx in year_group_indices[indices][1:]:
+            df.loc[idx, 'Year Group'] = ''
+    return df
+
+
+def timed(function, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function()
+    return (time.perf_counter() - start) / repeat
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--weeks', type=int, default=40)
+    parser.add_argument('--periods', type=int, default=4)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    program = make_program(args.weeks, args.periods)
+    filters = {
+        'no filters': ([], [], []),
+        'year groups': (YEAR_GROUPS[1:3], [], []),
+        'periods': ([], ['Period 1', 'Period 3'], []),
+        'weeks': ([], [], list(program.frame.columns[5:12])),
+        'all filters': (YEAR_GROUPS[:2], ['Period 1', 'Period 2'], list(program.frame.columns[2:6])),
+    }
+
+    for name, (years, periods, weeks) in filters.items():
+        # The old loop writes into the frame it is given when nothing is filtered, so it always gets a copy
+        expected = original(program.frame.copy(), years, periods, weeks)
+        pd.testing.assert_frame_equal(program.display_frame(years, periods, weeks), expected, check_dtype=False)
+        print(f'{name}: outputs match')
+
+    print(f'{args.weeks} weeks, {len(YEAR_GROUPS)} year groups, {args.periods} periods')
+    print(f'original      {timed(lambda: original(program.frame.copy(), [], [], []), args.repeat) * 1000:.1f} ms')
+    print(f'display_frame {timed(lambda: program.display_frame(), args.repeat) * 1000:.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
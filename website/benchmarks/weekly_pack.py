@@ -0,0 +1,98 @@
+# Wall-clock time to build a weekly pack, one document at a time versus through LessonPlanRenderer
+# - Documents are served from a local HTTP server with a fixed delay per request, standing in for storage
+# - Run from website/: python benchmarks/weekly_pack.py [--documents 12] [--latency 0.25]
+import argparse
+import io
+import pathlib
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pymupdf
+import requests
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+
+from handlers.data.LessonPlanRenderer import PLACEHOLDERS, LessonPlanRenderer, fill_placeholders
+
+
+def make_template(pages: int = 6) -> bytes:
+    pdf = pymupdf.open()
+    for _ in range(pages):
+        page = pdf.new_page()
+        y = 72
+        for key in PLACEHOLDERS:
+            page.insert_text((72, y), f'{key} lorem ipsum dolor sit amet')
+            y += 20
+        for line in range(30):
+            page.insert_text((72, y), f'Body text line {line} of the lesson plan.', fontsize=9)
+            y += 12
+    return pdf.tobytes()
+
+
+def serve(template: bytes, latency: float) -> ThreadingHTTPServer:
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, *args) -> None:
+            pass
+
+        def do_GET(self) -> None:
+            time.sleep(latency)
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(template)))
+            self.end_headers()
+            self.wfile.write(template)
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def replacements(file: dict, date: str) -> dict:
+    return {key: '' for key in PLACEHOLDERS} | {'[DATE]': date, '[INSTRUCTOR]': file['instructor'], '[NAME]': file['instructor']}
+
+
+def sequential(files: list, date: str) -> bytes:
+    # The original loop: download, fill and merge each document in turn on one thread
+    merged = pymupdf.open()
+    for file in files:
+        data = requests.get(file['url'], timeout=30).content
+        merged.insert_pdf(pymupdf.open(stream=fill_placeholders(data, replacements(file, date))[0]))
+    output = io.BytesIO()
+    merged.save(output)
+    return output.getvalue()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--documents', type=int, default=12)
+    parser.add_argument('--latency', type=float, default=0.25)
+    args = parser.parse_args()
+
+    server = serve(make_template(), args.latency)
+    files = [
+        {'url': f'http://127.0.0.1:{server.server_port}/{index}.pdf', 'source': f'bench/{index}', 'version': str(time.time()), 'instructor': f'Cpl {index}'}
+        for index in range(args.documents)
+    ]
+
+    start = time.perf_counter()
+    expected = sequential(files, '01/01/2026')
+    sequential_seconds = time.perf_counter() - start
+
+    renderer = LessonPlanRenderer()
+    renderer.render_pool().submit(int).result()  # start the worker processes outside the timing
+    start = time.perf_counter()
+    output = renderer.build_weekly_pack(files, '01/01/2026')
+    pipeline_seconds = time.perf_counter() - start
+
+    pages = pymupdf.open(stream=output).page_count
+    assert pages == pymupdf.open(stream=expected).page_count, 'page counts differ'
+    print(f'{args.documents} documents, {args.latency * 1000:.0f} ms per download, {pages} pages')
+    print(f'sequential {sequential_seconds:.2f} s')
+    print(f'renderer   {pipeline_seconds:.2f} s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+import streamlit as st
+
+import hashlib
+import json
+import os
+import pathlib
+import tempfile
+import threading
+import time
+
+import requests
+
+from handlers.data.HttpClient import get_http_client
+from handlers.data.RenderCache import RenderCache
+
+
+class BlobCache:
+    MAX_BYTES = 1024 * 1024 * 1024
+    HOT_BYTES = 256 * 1024 * 1024
+    REVALIDATE_INTERVAL = 3600
+
+    def __init__(self, directory: str, max_bytes: int = MAX_BYTES) -> None:
+        # Remote files kept on disk by a stable identity, since signed URLs change every time they are re-signed
+        # - index.json holds the version, validators, size and last access of every stored file
+        self.directory = pathlib.Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.http = get_http_client()
+        # Recently read files, shared as one bytes object by every session previewing them
+        self._hot = RenderCache(self.HOT_BYTES)
+        self._index_path = self.directory / 'index.json'
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        try:
+            with open(self._index_path, 'r') as file:
+                self._index = json.load(file)
+        except (OSError, ValueError):
+            self._index = {}
+        # Drop entries whose file has gone missing
+        self._index = {key: entry for key, entry in self._index.items() if (self.directory / entry['file']).exists()}
+
+    def _save_index(self) -> None:
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as file:
+            json.dump(self._index, file)
+        os.replace(tmp_path, self._index_path)
+
+    def _key_lock(self, key: str) -> threading.Lock:
+        with self._lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    def path(self, key: str, url: str, version: str | None = None, max_age: float | None = None) -> pathlib.Path:
+        # With a version (e.g. the storage object's content hash) a matching stored file is served without a request
+        # - Without one, the stored file is revalidated with If-None-Match / If-Modified-Since once it is older than max_age
+        max_age = self.REVALIDATE_INTERVAL if max_age is None else max_age
+        with self._key_lock(key):
+            entry = self._index.get(key)
+            now = time.time()
+            if entry is not None:
+                if version is not None and entry['version'] == version:
+                    return self._touch(key, entry, now)
+                if version is None and now - entry['checked'] < max_age:
+                    return self._touch(key, entry, now)
+
+            headers = {}
+            if entry is not None and version is None:
+                if entry.get('etag'):
+                    headers['If-None-Match'] = entry['etag']
+                if entry.get('last_modified'):
+                    headers['If-Modified-Since'] = entry['last_modified']
+            try:
+                with self.http.stream(url, headers=headers) as response:
+                    if response.status_code == 304 and entry is not None:
+                        entry['checked'] = now
+                        return self._touch(key, entry, now, save=True)
+                    response.raise_for_status()
+                    return self._store(key, response, version, now)
+            except (requests.ConnectionError, requests.Timeout):
+                # Serve the stored copy of an unversioned file while the source is unreachable
+                if entry is not None and version is None:
+                    return self._touch(key, entry, now)
+                raise
+
+    def get(self, key: str, url: str, version: str | None = None) -> bytes:
+        path = self.path(key, url, version)
+        entry = self._index.get(key, {})
+        hot_key = f'{path.name}:{entry.get("stored")}'
+        data = self._hot.get(hot_key)
+        if data is None:
+            data = path.read_bytes()
+            self._hot.put(hot_key, data)
+        return data
+
+    def stored_version(self, key: str) -> str | None:
+        # Identity of the stored content of an unversioned file, which changes whenever a revalidation stores a new copy
+        # - Only reads the index, so it never makes a request, and is None when nothing is stored yet
+        entry = self._index.get(key)
+        if entry is None:
+            return None
+        return entry.get('etag') or str(entry['stored'])
+
+    def _touch(self, key: str, entry: dict, now: float, save: bool = False) -> pathlib.Path:
+        with self._lock:
+            entry['accessed'] = now
+            if save:
+                self._save_index()
+        return self.directory / entry['file']
+
+    def _store(self, key: str, response: requests.Response, version: str | None, now: float) -> pathlib.Path:
+        name = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            # Streamed to disk so large PDFs are never held in memory whole
+            with os.fdopen(fd, 'wb') as file:
+                for chunk in response.iter_content(self.http.CHUNK_SIZE):
+                    file.write(chunk)
+                    size += len(chunk)
+            os.replace(tmp_path, self.directory / name)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        with self._lock:
+            self._index[key] = {
+                'file': name,
+                'version': version,
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified'),
+                'size': size,
+                'stored': now,
+                'checked': now,
+                'accessed': now,
+            }
+            self._evict(keep=key)
+            self._save_index()
+        return self.directory / name
+
+    def _evict(self, keep: str) -> None:
+        # Least recently used files go first once the cache is over its size cap
+        total = sum(entry['size'] for entry in self._index.values())
+        for key in sorted(self._index, key=lambda k: self._index[k]['accessed']):
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            entry = self._index.pop(key)
+            (self.directory / entry['file']).unlink(missing_ok=True)
+            total -= entry['size']
+
+
+@st.cache_resource
+def get_blob_cache() -> BlobCache:
+    return BlobCache(os.path.join(tempfile.gettempdir(), '49sqn_blobs'))
@@ -0,0 +1,101 @@
+import streamlit as st
+
+import contextlib
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class HttpClient:
+    TIMEOUT = (5, 30)  # connect and read seconds
+    MAX_RETRIES = 3
+    BACKOFF = 0.5  # seconds before the first retry, doubled on each attempt
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+    HOST_LIMIT = 6  # concurrent requests per host
+    CHUNK_SIZE = 1024 * 1024
+
+    def __init__(self) -> None:
+        # One keep-alive session for every download, so repeat requests to a host reuse its connections
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=8, pool_maxsize=self.HOST_LIMIT)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self._lock = threading.Lock()
+        self._host_slots = {}
+        self._metrics = {}
+
+    def _slots(self, host: str) -> threading.BoundedSemaphore:
+        with self._lock:
+            return self._host_slots.setdefault(host, threading.BoundedSemaphore(self.HOST_LIMIT))
+
+    def _record(self, host: str, seconds: float, size: int = 0, retries: int = 0, error: bool = False) -> None:
+        with self._lock:
+            metrics = self._metrics.setdefault(host, {'requests': 0, 'errors': 0, 'retries': 0, 'bytes': 0, 'seconds': 0.0})
+            metrics['requests'] += 1
+            metrics['errors'] += error
+            metrics['retries'] += retries
+            metrics['bytes'] += size
+            metrics['seconds'] += seconds
+
+    def _send(self, url: str, retries: int | None, **kwargs) -> tuple:
+        # Retries connection errors and retryable statuses with exponential backoff
+        retries = self.MAX_RETRIES if retries is None else retries
+        kwargs.setdefault('timeout', self.TIMEOUT)
+        for attempt in range(retries + 1):
+            try:
+                response = self.session.get(url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == retries:
+                    raise
+            else:
+                if response.status_code not in self.RETRY_STATUSES or attempt == retries:
+                    return response, attempt
+                response.close()
+            time.sleep(self.BACKOFF * 2 ** attempt)
+
+    def get(self, url: str, retries: int | None = None, **kwargs) -> requests.Response:
+        host = urlsplit(url).netloc
+        start = time.perf_counter()
+        attempts = 0
+        with self._slots(host):
+            try:
+                response, attempts = self._send(url, retries, **kwargs)
+                size = len(response.content)
+            except requests.RequestException:
+                self._record(host, time.perf_counter() - start, error=True)
+                raise
+        self._record(host, time.perf_counter() - start, size, attempts, response.status_code >= 400)
+        return response
+
+    @contextlib.contextmanager
+    def stream(self, url: str, retries: int | None = None, **kwargs):
+        # For large files, the body is read in chunks with response.iter_content(self.CHUNK_SIZE) inside the block
+        host = urlsplit(url).netloc
+        start = time.perf_counter()
+        with self._slots(host):
+            try:
+                response, attempts = self._send(url, retries, stream=True, **kwargs)
+            except requests.RequestException:
+                self._record(host, time.perf_counter() - start, error=True)
+                raise
+            try:
+                yield response
+            finally:
+                size = response.raw.tell() if response.raw is not None else 0
+                response.close()
+                self._record(host, time.perf_counter() - start, size, attempts, response.status_code >= 400)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                host: {**metrics, 'seconds': round(metrics['seconds'], 3), 'average_ms': round(metrics['seconds'] / metrics['requests'] * 1000)}
+                for host, metrics in self._metrics.items()
+            }
+
+
+@st.cache_resource
+def get_http_client() -> HttpClient:
+    return HttpClient()
@@ -0,0 +1,122 @@
+import streamlit as st
+
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Job:
+    def __init__(self, key: str, label: str) -> None:
+        self.key = key
+        self.label = label
+        self.status = 'queued'
+        self.progress = 0.0
+        self.message = ''
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.finished = None
+        # Set when a new request arrives while the job is running, it runs again with these arguments once it finishes
+        self.rerun = None
+
+    @property
+    def done(self) -> bool:
+        return self.status in ('done', 'failed')
+
+    def update(self, message: str = '', progress: float | None = None) -> None:
+        # Called from the job itself to report how far it has got
+        self.message = message
+        if progress is not None:
+            self.progress = min(max(progress, 0.0), 1.0)
+
+
+class JobRunner:
+    MAX_WORKERS = 2
+    RETENTION = 3600  # seconds a finished job stays in the registry
+
+    def __init__(self, max_workers: int = MAX_WORKERS, nice: int = 0) -> None:
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='job', initializer=self._set_nice, initargs=(nice,))
+        self._lock = threading.Lock()
+        self.jobs = {}
+
+    def submit(self, key: str, label: str, func, *args, rerun: bool = False, **kwargs) -> Job:
+        # Requests for a job that is already queued or running join it instead of starting another
+        # - With rerun, a running job runs again with the new arguments once it finishes, for inputs that changed after it read them
+        # - func runs on a worker thread outside any script run, so it must not call Streamlit
+        with self._lock:
+            self._prune()
+            job = self.jobs.get(key)
+            if job is not None and not job.done:
+                if rerun:
+                    job.rerun = (func, args, kwargs)
+                return job
+            job = Job(key, label)
+            self.jobs[key] = job
+        self._pool.submit(self._run, job, func, args, kwargs)
+        return job
+
+    def get(self, key: str) -> Job | None:
+        return self.jobs.get(key)
+
+    def clear(self, key: str) -> None:
+        with self._lock:
+            job = self.jobs.get(key)
+            if job is not None and job.done:
+                self.jobs.pop(key)
+
+    def _run(self, job: Job, func, args: tuple, kwargs: dict) -> None:
+        job.status = 'running'
+        while True:
+            result, error = None, None
+            try:
+                result = func(job, *args, **kwargs)
+            except Exception as e:
+                error = e
+            # Finishing under the lock means a rerun request either lands before this check or starts a new job
+            with self._lock:
+                if job.rerun is None:
+                    job.result = result
+                    job.error = error
+                    if error is None:
+                        job.progress = 1.0
+                    job.finished = time.time()
+                    job.status = 'done' if error is None else 'failed'
+                    return
+                func, args, kwargs = job.rerun
+                job.rerun = None
+                job.progress = 0.0
+
+    @staticmethod
+    def _set_nice(nice: int) -> None:
+        # Linux applies nice values per thread, elsewhere the jobs run at normal priority
+        if nice:
+            try:
+                os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), nice)
+            except (AttributeError, OSError):
+                pass
+
+    def _prune(self) -> None:
+        expired = [key for key, job in self.jobs.items() if job.done and time.time() - job.finished > self.RETENTION]
+        for key in expired:
+            self.jobs.pop(key)
+
+
+@st.cache_resource
+def get_job_runner() -> JobRunner:
+    return JobRunner()
+
+
+@st.cache_resource
+def get_background_runner() -> JobRunner:
+    # Long low priority jobs, such as indexing, kept apart from the jobs users are waiting on
+    return JobRunner(max_workers=1, nice=10)
+
+
+@st.fragment(run_every=2)
+def job_status(key: str) -> None:
+    # Polls a running job, rerunning the page once it finishes so the result can be shown
+    job = get_job_runner().get(key)
+    if job is None or job.done:
+        st.rerun()
+    st.progress(job.progress, text=f'{job.label}... {job.message}'.strip())
@@ -0,0 +1,35 @@
+import re
+
+
+def lesson_code(name: str) -> str:
+    # 'Year 1 DRL 1.2 - Title.pdf' -> 'DRL 1.2'
+    return name.removesuffix('.pdf').removeprefix('Year ').removeprefix('1').removeprefix('2').removeprefix('3').removeprefix('4').split('-')[0].strip()
+
+
+class LessonIndex:
+    def __init__(self, lesson_plans: list, syllabus: dict) -> None:
+        # Kept so the owner can tell which listing and syllabus the index was built from
+        self.lesson_plans = lesson_plans
+        self.syllabus = syllabus
+
+        self.plans = {}
+        for file in lesson_plans:
+            code = lesson_code(file['path'])
+            if code:
+                self.plans.setdefault(code, file)
+
+        self.guides = {}
+        for name in syllabus:
+            self.guides.setdefault(lesson_code(name), name)
+
+    def resolve(self, code: str) -> dict | str | None:
+        # Local lesson plans win over 170C instructor guides
+        # - Without an exact match, a lesson variant falls back to its base lesson, e.g. 'DRL 1.2a' -> 'DRL 1.2'
+        code = code.split('-')[0].strip()
+        file = self.plans.get(code) or self.guides.get(code)
+        if file is not None:
+            return file
+        base = re.sub(r'(?<=\d)[A-Za-z]+$', '', code)
+        if base != code:
+            return self.plans.get(base) or self.guides.get(base)
+        return None
@@ -0,0 +1,146 @@
+import streamlit as st
+
+import hashlib
+import io
+import multiprocessing
+import os
+import pymupdf
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+
+from handlers.data.RenderCache import RenderCache
+from handlers.data.BlobCache import get_blob_cache
+
+
+PLACEHOLDERS = ('[DATE]', '[INSTRUCTOR]', '[NAME]', '[NEXT_LESSON]', '[NEXT_INSTRUCTOR]', '[NEXT_LOCATION]', '[NEXT_TIMING]', '[NEXT_DRESS]')
+
+
+def find_placeholders(pdf: pymupdf.Document | bytes) -> list:
+    if isinstance(pdf, bytes):
+        pdf = pymupdf.open(stream=pdf)
+    return [(page.number, tuple(rect), key) for page in pdf for key in PLACEHOLDERS for rect in page.search_for(key)]
+
+
+def fill_placeholders(data: bytes, replacements: dict, placements: list | None = None) -> tuple:
+    # Returns the placements with the filled document so they can be cached for the template
+    pdf = pymupdf.open(stream=data)
+    if placements is None:
+        placements = find_placeholders(pdf)
+    pages = set()
+    for page_number, inst, key in placements:
+        if key in replacements:
+            rect = pymupdf.Rect(inst)
+            rect.y0 -= 10
+            rect.y1 += 10
+            rect.x1 += 300
+            pdf[page_number].add_redact_annot(rect, replacements[key], fontsize=12)
+            pages.add(page_number)
+    for page_number in sorted(pages):
+        pdf[page_number].apply_redactions()
+    return pdf.tobytes(), placements
+
+
+def merge_documents(documents: list) -> bytes:
+    merged = pymupdf.open()
+    for data in documents:
+        merged.insert_pdf(pymupdf.open(stream=data))
+    output = io.BytesIO()
+    merged.save(output)
+    return output.getvalue()
+
+
+class LessonPlanRenderer:
+    DOWNLOAD_WORKERS = 8
+    RENDER_WORKERS = min(4, os.cpu_count() or 1)
+    OUTPUT_CACHE_BYTES = 64 * 1024 * 1024
+    OUTPUT_SPILL_DIR = os.path.join(tempfile.gettempdir(), '49sqn_renders')
+
+    def __init__(self) -> None:
+        self.blobs = get_blob_cache()
+        self._downloads = ThreadPoolExecutor(max_workers=self.DOWNLOAD_WORKERS, thread_name_prefix='download')
+        self._renders = None
+        # Placeholder locations per template, keyed by content hash
+        self._placements = {}
+        # Filled lesson plans and weekly packs, keyed by their templates and replacement values
+        self.outputs = RenderCache(self.OUTPUT_CACHE_BYTES, self.OUTPUT_SPILL_DIR)
+
+    def render_pool(self) -> ProcessPoolExecutor:
+        # PyMuPDF is not thread safe, so every call into it runs in these processes, never on a session or job thread
+        # - Functions sent here are defined at module level so the spawned processes can import them
+        if self._renders is None:
+            self._renders = ProcessPoolExecutor(max_workers=self.RENDER_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+        return self._renders
+
+    def download(self, file: dict) -> bytes:
+        # Templates come from the disk cache, keyed by their stable source rather than the signed URL
+        return self.blobs.get(file['source'], file['url'], file.get('version'))
+
+    def placements(self, data: bytes, digest: str | None = None) -> list:
+        digest = digest or hashlib.sha1(data).hexdigest()
+        if digest not in self._placements:
+            self._placements[digest] = self.render_pool().submit(find_placeholders, data).result()
+        return self._placements[digest]
+
+    def fill_key(self, data: bytes, replacements: dict) -> str:
+        # Fills the template unless the output is already cached, and returns its key in self.outputs
+        digest = hashlib.sha1(data).hexdigest()
+        key = RenderCache.key('fill', digest, replacements)
+        if self.outputs.get(key) is None:
+            self.outputs.put(key, self.render_pool().submit(fill_placeholders, data, replacements, self.placements(data, digest)).result()[0])
+        return key
+
+    def _store_placements(self, digest: str, render) -> None:
+        if not render.exception():
+            self._placements.setdefault(digest, render.result()[1])
+
+    def weekly_pack_key(self, files: list, date: str) -> str:
+        # Files carry a stable source (bucket and path, or guide URL) and version since signed URLs change on every listing
+        # - Guides have no storage version, so the identity of their stored copy stands in for it, or the URL before one is stored
+        # - Never makes a request, since it is called from the script thread when the pack is opened
+        return RenderCache.key('weekly_pack', date, [(file['source'], file.get('version') or self.blobs.stored_version(file['source']) or file['url'], file['instructor']) for file in files])
+
+    def cached_weekly_pack(self, files: list, date: str) -> bytes | None:
+        return self.outputs.get(self.weekly_pack_key(files, date))
+
+    def build_weekly_pack(self, files: list, date: str, progress=None) -> bytes:
+        # Downloads every document at once, fills each one as soon as it arrives and merges them in schedule order
+        key = self.weekly_pack_key(files, date)
+        output = self.outputs.get(key)
+        if output is not None:
+            return output
+
+        downloads = {self._downloads.submit(self.download, file): index for index, file in enumerate(files)}
+        renders = [None] * len(files)
+        for done, download in enumerate(as_completed(downloads)):
+            index = downloads[download]
+            if progress is not None:
+                progress(f'{done}/{len(files)} documents downloaded', done / max(len(files), 1) / 2)
+            replacements = {
+                '[DATE]': date,
+                '[INSTRUCTOR]': files[index]['instructor'],
+                '[NAME]': files[index]['instructor'],
+                '[NEXT_LESSON]': '',
+                '[NEXT_INSTRUCTOR]': '',
+                '[NEXT_LOCATION]': '',
+                '[NEXT_TIMING]': '',
+                '[NEXT_DRESS]': '',
+            }
+            data = download.result()
+            digest = hashlib.sha1(data).hexdigest()
+            renders[index] = self.render_pool().submit(fill_placeholders, data, replacements, self._placements.get(digest))
+            renders[index].add_done_callback(lambda render, digest=digest: self._store_placements(digest, render))
+
+        documents = []
+        for index, render in enumerate(renders):
+            if progress is not None:
+                progress(f'{index}/{len(files)} documents filled', 0.5 + index / max(len(files), 1) / 2)
+            documents.append(render.result()[0])
+        output = self.render_pool().submit(merge_documents, documents).result()
+        # Keyed again now the downloads have stored or revalidated every guide
+        self.outputs.put(self.weekly_pack_key(files, date), output)
+        return output
+
+
+@st.cache_resource
+def get_lesson_plan_renderer() -> LessonPlanRenderer:
+    return LessonPlanRenderer()
@@ -1,65 +1,219 @@
+import hashlib
 import json
+import os
 import pathlib
 import requests
+import tempfile
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 import streamlit as st
 
+from handlers.data.HttpClient import get_http_client
+
 class NZCF170CLoader:
     WORKER_URL = "https://wild-lab-6641.hamishlester555.workers.dev/"
     BATCH_SIZE = 15
-    DELAY = 1.0  # seconds between requests
+    DELAY = 1.0  # minimum seconds between requests, shared by all workers
+    WORKERS = 4
+    MAX_RETRIES = 5
+    BACKOFF = 1.0  # seconds before the first retry, doubled on each attempt
+    TIMEOUT = 30
+    CHECKPOINT_MAX_AGE = 86400  # seconds before an interrupted sync starts over
 
-    def __init__(self, base_path: str):
+    def __init__(self, base_path: str, token: str | None = None, worker_url: str | None = None, incremental: bool = True):
         self.out_path = pathlib.Path(base_path) / "resources/configurations/syllabus.json"
+        self.checkpoint_path = self.out_path.with_name("syllabus.sync.json")
+        self.hashes_path = self.out_path.with_name("syllabus.hashes.json")
+        self.worker_url = worker_url or self.WORKER_URL
+        self.token = token if token is not None else st.secrets["cadetnet"]["TOKEN"]
+        self.incremental = incremental
+        self._known_hashes = None
+        self.http = get_http_client()
+
+        self._rate_lock = threading.Lock()
+        self._next_request = 0.0
 
-    def _get_existing_data(self) -> dict:
-        if self.out_path.exists():
+    def _get_existing_data(self, path: pathlib.Path | None = None) -> dict:
+        path = path or self.out_path
+        if path.exists():
             try:
-                with self.out_path.open("r", encoding="utf-8") as f:
+                with path.open("r", encoding="utf-8") as f:
                     return json.load(f)
             except json.JSONDecodeError:
                 return {}
         return {}
 
-    def _save_json(self, data: dict) -> None:
-        self.out_path.parent.mkdir(parents=True, exist_ok=True)
-        with self.out_path.open("w", encoding="utf-8") as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+    def _save_json(self, data: dict, path: pathlib.Path | None = None) -> None:
+        # Write to a temporary file and rename it so readers never see a partial file
+        path = path or self.out_path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
 
-    def fetch_all_lessons(self) -> dict:
-        lessons = self._get_existing_data()
-        start = 0
+    def _load_checkpoint(self) -> dict:
+        try:
+            with self.checkpoint_path.open("r", encoding="utf-8") as f:
+                checkpoint = json.load(f)
+            if time.time() - checkpoint["created"] < self.CHECKPOINT_MAX_AGE:
+                return checkpoint
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+        return {"created": time.time(), "batches": {}, "end": None}
+
+    def _wait_for_slot(self) -> None:
+        with self._rate_lock:
+            now = time.monotonic()
+            wait = self._next_request - now
+            self._next_request = max(now, self._next_request) + self.DELAY
+        if wait > 0:
+            time.sleep(wait)
 
-        while True:
-            params = {"start": start, "limit": self.BATCH_SIZE, "token": st.secrets["cadetnet"]["TOKEN"]}
+    def _fetch_batch(self, start: int) -> dict:
+        params = {"start": start, "limit": self.BATCH_SIZE, "token": self.token}
+        if self._known_hashes:
+            params["hashes"] = self._known_hashes
+        for attempt in range(self.MAX_RETRIES + 1):
+            self._wait_for_slot()
             try:
-                resp = requests.get(self.WORKER_URL, params=params, timeout=30)
+                # Retries are handled here so they share the rate limit
+                resp = self.http.get(self.worker_url, retries=0, params=params, timeout=self.TIMEOUT)
                 resp.raise_for_status()
-            except requests.RequestException as e:
-                st.error(f"[ERROR] Fetching batch starting at {start}: {e}")
-                time.sleep(self.DELAY)
-                continue
+                return resp.json()
+            except requests.HTTPError as e:
+                # Only the statuses the shared client retries are worth waiting for, a bad token fails straight away
+                if e.response.status_code not in self.http.RETRY_STATUSES or attempt == self.MAX_RETRIES:
+                    raise
+            except (requests.RequestException, ValueError):
+                if attempt == self.MAX_RETRIES:
+                    raise
+                time.sleep(self.BACKOFF * 2 ** attempt)
+
+    def sync_batches(self, progress=None) -> dict:
+        # Fetches every batch from the worker, resuming from the checkpoint of an interrupted sync
+        checkpoint = self._load_checkpoint()
+        batches = checkpoint["batches"]
+        start = 0
+
+        with ThreadPoolExecutor(max_workers=self.WORKERS) as pool:
+            while checkpoint["end"] is None:
+                window = [start + i * self.BATCH_SIZE for i in range(self.WORKERS)]
+                start = window[-1] + self.BATCH_SIZE
+                futures = {s: pool.submit(self._fetch_batch, s) for s in window if str(s) not in batches}
+                error = None
+                for batch_start, future in futures.items():
+                    try:
+                        batches[str(batch_start)] = future.result()
+                    except (requests.RequestException, ValueError) as e:
+                        error = error or e
+                if error is None:
+                    if self._known_hashes and not all(self._has_end_marker(batches[str(s)]) for s in window):
+                        # The worker ignored the hashes, so an empty batch could still be modules it left out
+                        self._known_hashes = None
+                        checkpoint = {"created": time.time(), "batches": {}, "end": None}
+                        batches = checkpoint["batches"]
+                        start = 0
+                        continue
+                    end = [s for s in window if self._is_end(batches[str(s)])]
+                    if end:
+                        checkpoint["end"] = end[0]
+                # Keep the finished batches so a failed sync resumes where it stopped
+                self._save_json(checkpoint, self.checkpoint_path)
+                if error is not None:
+                    raise error
+                if progress is not None:
+                    progress(f'{len(batches)} batches fetched')
+
+        return {int(s): batch for s, batch in batches.items() if int(s) < checkpoint["end"]}
 
-            batch = resp.json()
-            if not batch:
-                break
+    @staticmethod
+    def _has_end_marker(batch: dict) -> bool:
+        return "_end" in batch or "_count" in batch
 
+    def _is_end(self, batch: dict) -> bool:
+        # The worker marks the end of the catalogue with _end or a _count of zero pages
+        # - An empty batch only ends a full sync, in an incremental one it may just hold unchanged modules
+        if self._has_end_marker(batch):
+            return bool(batch.get("_end")) or batch.get("_count") == 0
+        return not batch and not self._known_hashes
+
+    @staticmethod
+    def _clean_title(title: str) -> str:
+        title = title.replace('&#8211;', '-').lstrip('- ')
+        return title.replace('/', ' or ').replace('&#038;', 'and').replace('&#8217;', "'")
+
+    @staticmethod
+    def module_hash(lessons_dict: dict) -> str:
+        # Short content hash of a module as the worker sent it, so the worker can compare it with its own
+        return hashlib.sha1(json.dumps(lessons_dict, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()[:12]
+
+    def fetch_all_lessons(self, progress=None) -> dict:
+        # Syncs syllabus.json with CadetNet and returns the added, changed and removed lessons
+        # - Modules the worker reports as unchanged (null) are kept as they are, as are the ones it leaves out of an incremental sync
+        lessons = self._get_existing_data()
+        hashes = self._get_existing_data(self.hashes_path)
+        if self.incremental and hashes:
+            self._known_hashes = json.dumps(hashes, separators=(",", ":"))
+
+        # Modules can be split across batches, so each one is put together from all of its fragments first
+        raw = {}
+        partial = set()
+        for start, batch in sorted(self.sync_batches(progress).items()):
             for year, modules in batch.items():
-                lessons.setdefault(year, {})
+                if year.startswith("_"):
+                    continue
                 for module, lessons_dict in modules.items():
-                    lessons[year].setdefault(module, {})
-                    for lesson_num, data in lessons_dict.items():
-                        data['title'] = data['title'].replace('&#8211;', '-').lstrip('- ')
-                        data['title'] = data['title'].replace('/', ' or ').replace('&#038;', 'and').replace('&#8217;', "'")
-                        if lesson_num in lessons[year][module]:
-                            if lessons[year][module][lesson_num]['title'] == data['title']:
-                                continue
-                        lessons[year][module][lesson_num] = data
-                        st.info(f"[SAVED] {year} {module} {lesson_num} - {data['title']}")
+                    raw.setdefault(year, {}).setdefault(module, {})
+                    if lessons_dict is None:
+                        partial.add((year, module))
+                    else:
+                        raw[year][module].update(lessons_dict)
 
-            self._save_json(lessons)
+        changes = {"added": [], "changed": [], "removed": []}
+        for year, modules in raw.items():
+            lessons.setdefault(year, {})
+            for module, lessons_dict in modules.items():
+                if (year, module) in partial and not lessons_dict:
+                    continue
+                existing = lessons[year].get(module, {})
+                if (year, module) in partial:
+                    # Part of the module was unchanged, so its stored lessons are kept and only the sent ones replaced
+                    # - The stored hash is left as it was, so a stale one only makes the worker send the module again
+                    merged = {**existing}
+                else:
+                    merged = {}
+                    hashes.setdefault(year, {})[module] = self.module_hash(lessons_dict)
+                for lesson_num, data in lessons_dict.items():
+                    merged[lesson_num] = {**data, 'title': self._clean_title(data['title'])}
+                for lesson_num, data in merged.items():
+                    if lesson_num not in existing:
+                        changes["added"].append(f"{year} {module} {lesson_num} - {data['title']}")
+                    elif existing[lesson_num] != data:
+                        changes["changed"].append(f"{year} {module} {lesson_num} - {data['title']}")
+                for lesson_num, data in existing.items():
+                    if lesson_num not in merged:
+                        changes["removed"].append(f"{year} {module} {lesson_num} - {data['title']}")
+                lessons[year][module] = merged
 
-            start += self.BATCH_SIZE
-            time.sleep(self.DELAY)
+        if not self._known_hashes and raw:
+            # A full sync sent every module, so any module it left out has been withdrawn
+            for year, modules in list(lessons.items()):
+                for module in [module for module in modules if module not in raw.get(year, {})]:
+                    for lesson_num, data in modules.pop(module).items():
+                        changes["removed"].append(f"{year} {module} {lesson_num} - {data['title']}")
+                    hashes.get(year, {}).pop(module, None)
+                if not modules:
+                    lessons.pop(year)
+
+        if any(changes.values()):
+            self._save_json(lessons)
+        self._save_json(hashes, self.hashes_path)
+        self.checkpoint_path.unlink(missing_ok=True)
 
-        return lessons
+        return changes
@@ -21,7 +21,7 @@ class PageConfig:
 
     def get_pages(self):
         admin_pages = []
-        admin_pages.append(st.Page('sub_pages/accounts/manage_users.py', title=self._('page.admin.manage_users'), icon=':material/group_search:')) if st.session_state.SUPABASE_CONNECTION.user and 'view_users' in st.session_state.SUPABASE_CONNECTION.user['permissions_expanded'] else None
+        admin_pages.append(st.Page('sub_pages/accounts/manage_users.py', title=self._('page.admin.manage_users'), icon=':material/group_search:')) if st.session_state.SUPABASE_CONNECTION.has_permission('view_users') else None
         return {
             self._('page.home'): [
                 st.Page('sub_pages/home.py', title=self._('page.home'), icon=':material/home:')
@@ -0,0 +1,82 @@
+import streamlit as st
+
+import hashlib
+import os
+import pathlib
+import tempfile
+import pymupdf
+
+from handlers.data.RenderCache import RenderCache
+from handlers.data.LessonPlanRenderer import get_lesson_plan_renderer
+
+
+def render_pages(source: bytes | str, pages: list, zoom: float) -> tuple:
+    # Files on disk are opened by path so the whole document is never sent between processes
+    pdf = pymupdf.open(source) if isinstance(source, str) else pymupdf.open(stream=source)
+    matrix = pymupdf.Matrix(zoom, zoom)
+    return pdf.page_count, {number: pdf[number].get_pixmap(matrix=matrix).tobytes('png') for number in pages if number < pdf.page_count}
+
+
+class PdfPreview:
+    PAGES = 3
+    MAX_PAGES = 10
+    ZOOM = 1.25
+    CACHE_BYTES = 64 * 1024 * 1024
+    SPILL_DIR = os.path.join(tempfile.gettempdir(), '49sqn_previews')
+
+    def __init__(self) -> None:
+        # Rendered page images, keyed by document identity, page number and zoom
+        self.pages = RenderCache(self.CACHE_BYTES, self.SPILL_DIR)
+        self._page_counts = {}
+
+    @staticmethod
+    def identity(source: bytes | pathlib.Path) -> str:
+        if isinstance(source, pathlib.Path):
+            return f'{source}:{source.stat().st_mtime_ns}'
+        return hashlib.sha1(source).hexdigest()
+
+    def page_count(self, source: bytes | pathlib.Path) -> int:
+        identity = self.identity(source)
+        if identity not in self._page_counts:
+            self.render(source, [0])
+        return self._page_counts[identity]
+
+    def render(self, source: bytes | pathlib.Path, pages: list) -> list:
+        # PNG images of the requested pages, only rendering the ones not cached yet
+        identity = self.identity(source)
+        keys = {number: RenderCache.key(identity, number, self.ZOOM) for number in pages}
+        images = {number: self.pages.get(key) for number, key in keys.items()}
+        missing = [number for number, image in images.items() if image is None]
+        if missing or identity not in self._page_counts:
+            render = get_lesson_plan_renderer().render_pool().submit(render_pages, str(source) if isinstance(source, pathlib.Path) else source, missing, self.ZOOM)
+            page_count, rendered = render.result()
+            self._page_counts[identity] = page_count
+            for number, image in rendered.items():
+                self.pages.put(keys[number], image)
+                images[number] = image
+        return [images[number] for number in pages if images.get(number) is not None]
+
+
+@st.cache_resource
+def get_pdf_preview() -> PdfPreview:
+    return PdfPreview()
+
+
+def preview_pdf(source: bytes | pathlib.Path, file_name: str, page: int = 0) -> None:
+    # Shows a few pages from page onwards as images, the full document is only sent to the browser when asked for
+    preview = get_pdf_preview()
+    page_count = preview.page_count(source)
+    data = source.read_bytes if isinstance(source, pathlib.Path) else source
+    st.download_button('Download PDF', data=data, file_name=file_name, mime='application/octet-stream', icon=':material/download:')
+    if st.toggle('Show Full Document', help='Load the whole document into the viewer'):
+        st.pdf(source.read_bytes() if isinstance(source, pathlib.Path) else source, height=750)
+        return
+
+    first = min(page, page_count - 1) + 1
+    last = min(page_count, first + preview.PAGES - 1)
+    if page_count > 1:
+        first, last = st.slider('Pages', 1, page_count, (first, last), help=f'Preview up to {preview.MAX_PAGES} pages at a time')
+        last = min(last, first + preview.MAX_PAGES - 1)
+    st.caption(f'*Showing pages {first}-{last} of {page_count}*')
+    numbers = list(range(first - 1, last))
+    st.image(preview.render(source, numbers), caption=[f'Page {number + 1}' for number in numbers])
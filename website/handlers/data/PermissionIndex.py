@@ -0,0 +1,53 @@
+import streamlit as st
+
+import json
+import os
+import time
+
+
+class PermissionIndex:
+    # Seconds between checks of permission_structure.json for changes
+    CHECK_INTERVAL = 5.0
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._mtime = None
+        self._checked_at = 0.0
+        self.load()
+
+    def load(self) -> None:
+        with open(self.path, 'r') as file:
+            structure = json.load(file)
+
+        roles = {role: frozenset(capabilities) for role, capabilities in structure.items()}
+        capability_roles = {}
+        for role, capabilities in roles.items():
+            for capability in capabilities:
+                capability_roles.setdefault(capability, set()).add(role)
+
+        self.role_names = list(roles)
+        self.roles = roles
+        self.capability_roles = {capability: frozenset(names) for capability, names in capability_roles.items()}
+        self._mtime = os.stat(self.path).st_mtime_ns
+        self._checked_at = time.monotonic()
+
+    def reload_if_changed(self) -> None:
+        if time.monotonic() - self._checked_at < self.CHECK_INTERVAL:
+            return
+        self._checked_at = time.monotonic()
+        if os.stat(self.path).st_mtime_ns != self._mtime:
+            self.load()
+
+    def expand(self, roles: list) -> frozenset:
+        self.reload_if_changed()
+        return frozenset().union(*(self.roles.get(role, frozenset()) for role in roles))
+
+    def allows(self, roles: list, capability: str) -> bool:
+        self.reload_if_changed()
+        granted_by = self.capability_roles.get(capability, frozenset())
+        return any(role in granted_by for role in roles)
+
+
+@st.cache_resource
+def get_permission_index(base_path: str) -> PermissionIndex:
+    return PermissionIndex(base_path + '/resources/configurations/permission_structure.json')
@@ -0,0 +1,72 @@
+import json
+import threading
+import time
+
+import requests
+
+from handlers.data.TrainingProgram import TrainingProgram
+
+
+class ProgramHistory:
+    BUCKET = 'training_programs'
+    PREFIX = 'history'
+    # Saves from other processes show up after this long, saves from this one straight away
+    INDEX_TTL = 300
+    _lock = threading.Lock()
+
+    def __init__(self, supabase, blobs, leases, shared) -> None:
+        # Append-only Parquet snapshots of each program's records, listed in history/<program>/index.json
+        # - Snapshot objects are never overwritten, so they can be cached on disk forever
+        self.supabase = supabase
+        self.blobs = blobs
+        self.leases = leases
+        self.shared = shared
+
+    def index_name(self, path: str) -> str:
+        return f'{self.PREFIX}/{path.removesuffix(".csv")}/index.json'
+
+    def snapshots(self, path: str) -> list:
+        # Parsed index kept per program, an empty history is cached too so it is not re-signed on every rerun
+        return self.shared.get(('history', path), lambda: self._read(path), self.INDEX_TTL)
+
+    def _read(self, path: str) -> list:
+        file = {'path': self.index_name(path)}
+        self.leases.sign(self.supabase, self.BUCKET, [file])
+        if not file['signedURL']:
+            return []
+        try:
+            return json.loads(self.blobs.path(f'{self.BUCKET}/{file["path"]}', file['signedURL'], max_age=0).read_bytes())
+        except requests.HTTPError as e:
+            if e.response is None or e.response.status_code not in (400, 404):
+                raise
+            return []
+
+    def save(self, path: str, program: TrainingProgram, source: str) -> dict | None:
+        # Snapshots the program saved as the CSV with hash source, unless that content is already the latest snapshot
+        with self._lock:
+            snapshots = self._read(path)
+            if snapshots and snapshots[-1]['source'] == source:
+                return None
+            data = program.records().to_parquet(index=False)
+            snapshot = {
+                'object': f'{self.PREFIX}/{path.removesuffix(".csv")}/{time.strftime("%Y%m%dT%H%M%S", time.gmtime())}_{source[:8]}.parquet',
+                'source': source,
+                'size': len(data),
+                'saved': time.time(),
+            }
+            storage = self.supabase.client.storage.from_(self.BUCKET)
+            storage.upload(snapshot['object'], data, file_options={'content-type': 'application/vnd.apache.parquet'})
+            storage.upload(
+                self.index_name(path),
+                json.dumps([*snapshots, snapshot], indent=1).encode('utf-8'),
+                file_options={'content-type': 'application/json', 'cache-control': '0', 'x-upsert': 'true'}
+            )
+            self.shared.invalidate(('history', path))
+        return snapshot
+
+    @staticmethod
+    def since(snapshots: list, seconds: float) -> dict | None:
+        # The latest snapshot at least seconds old, or the oldest one when the history is shorter than that
+        cutoff = time.time() - seconds
+        older = [snapshot for snapshot in snapshots if snapshot['saved'] <= cutoff]
+        return older[-1] if older else (snapshots[0] if snapshots else None)
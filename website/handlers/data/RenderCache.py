@@ -0,0 +1,72 @@
+import hashlib
+import json
+import os
+import pathlib
+import tempfile
+import threading
+from collections import OrderedDict
+
+
+class RenderCache:
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, spill_dir: str | None = None, spill_max_bytes: int = 512 * 1024 * 1024) -> None:
+        # Least recently used outputs are evicted from memory first, and written to spill_dir when it is set
+        self.max_bytes = max_bytes
+        self.spill_dir = pathlib.Path(spill_dir) if spill_dir else None
+        self.spill_max_bytes = spill_max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        if self.spill_dir is not None:
+            self.spill_dir.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def key(*parts) -> str:
+        return hashlib.sha1(json.dumps(parts, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> bytes | None:
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+                return data
+        if self.spill_dir is None:
+            return None
+        try:
+            data = (self.spill_dir / key).read_bytes()
+        except OSError:
+            return None
+        self.put(key, data)
+        return data
+
+    def put(self, key: str, data: bytes) -> None:
+        evicted = []
+        with self._lock:
+            if key in self._entries:
+                self._size -= len(self._entries.pop(key))
+            self._entries[key] = data
+            self._size += len(data)
+            while self._size > self.max_bytes and len(self._entries) > 1:
+                old_key, old_data = self._entries.popitem(last=False)
+                self._size -= len(old_data)
+                evicted.append((old_key, old_data))
+        for old_key, old_data in evicted:
+            self._spill(old_key, old_data)
+
+    def _spill(self, key: str, data: bytes) -> None:
+        if self.spill_dir is None:
+            return
+        path = self.spill_dir / key
+        if not path.exists():
+            fd, tmp_path = tempfile.mkstemp(dir=self.spill_dir, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as file:
+                file.write(data)
+            os.replace(tmp_path, path)
+
+        # Trim the oldest spilled outputs once the directory is over its cap
+        files = sorted((f for f in self.spill_dir.iterdir() if not f.name.endswith('.tmp')), key=lambda f: f.stat().st_mtime)
+        total = sum(f.stat().st_size for f in files)
+        for file in files:
+            if total <= self.spill_max_bytes:
+                break
+            total -= file.stat().st_size
+            file.unlink(missing_ok=True)
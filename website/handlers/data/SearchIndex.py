@@ -0,0 +1,151 @@
+import streamlit as st
+
+import multiprocessing
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+import pymupdf
+import requests
+from concurrent.futures import ProcessPoolExecutor
+
+from handlers.data.JobRunner import get_background_runner
+
+
+def extract_pages(path: str) -> list:
+    return [page.get_text() for page in pymupdf.open(path)]
+
+
+def _lower_priority(nice: int) -> None:
+    # Windows has no nice values, there the extraction runs at normal priority
+    try:
+        os.nice(nice)
+    except (AttributeError, OSError):
+        pass
+
+
+class SearchIndex:
+    REFRESH_INTERVAL = 86400
+    RETRY_INTERVAL = 900  # seconds before an update that had failures is tried again
+    EXTRACT_NICE = 10
+
+    def __init__(self, path: str) -> None:
+        # Full text of every page in an SQLite FTS5 table, with one row per document and page
+        # - documents holds the title, kind and version each document was indexed at, so updates only re-read changed files
+        self._lock = threading.Lock()
+        self._extracts = None
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._db:
+            self._db.execute('CREATE TABLE IF NOT EXISTS documents (id TEXT PRIMARY KEY, title TEXT, kind TEXT, version TEXT)')
+            self._db.execute("CREATE VIRTUAL TABLE IF NOT EXISTS pages USING fts5(text, id UNINDEXED, page UNINDEXED, tokenize='porter unicode61')")
+            self._db.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+            # Documents the source refused (e.g. a dead manual link), which no longer keep the whole index stale
+            self._db.execute('CREATE TABLE IF NOT EXISTS unavailable (id TEXT PRIMARY KEY, error TEXT, checked REAL)')
+
+    def extract_pool(self) -> ProcessPoolExecutor:
+        # Text is read in one low priority process of its own, so a large reindex never holds up the render pool users wait on
+        if self._extracts is None:
+            self._extracts = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn'), initializer=_lower_priority, initargs=(self.EXTRACT_NICE,))
+        return self._extracts
+
+    @property
+    def updated(self) -> float:
+        with self._lock:
+            row = self._db.execute("SELECT value FROM meta WHERE key = 'updated'").fetchone()
+        return float(row[0]) if row else 0.0
+
+    def is_stale(self) -> bool:
+        return time.time() - self.updated > self.REFRESH_INTERVAL
+
+    def update(self, sources: dict, progress=None) -> dict:
+        # sources maps a document id to (title, kind, path), where path is a callable returning the file on disk
+        with self._lock:
+            versions = dict(self._db.execute('SELECT id, version FROM documents'))
+        counts = {'indexed': 0, 'unchanged': 0, 'removed': 0, 'unavailable': 0, 'failed': 0}
+        for done, (doc_id, (title, kind, path)) in enumerate(sources.items()):
+            if progress is not None and done % 10 == 0:
+                progress(f'{done}/{len(sources)} documents checked', done / max(len(sources), 1))
+            try:
+                file = path()
+                version = str(file.stat().st_mtime_ns)
+                if versions.get(doc_id) == version:
+                    counts['unchanged'] += 1
+                    continue
+                texts = self.extract_pool().submit(extract_pages, str(file)).result()
+            except requests.HTTPError as e:
+                if not self._permanent(e):
+                    counts['failed'] += 1
+                    continue
+                with self._lock, self._db:
+                    self._db.execute('INSERT OR REPLACE INTO unavailable VALUES (?, ?, ?)', (doc_id, str(e), time.time()))
+                counts['unavailable'] += 1
+                continue
+            except Exception:
+                counts['failed'] += 1
+                continue
+            with self._lock, self._db:
+                self._db.execute('DELETE FROM unavailable WHERE id = ?', (doc_id,))
+                self._db.execute('DELETE FROM pages WHERE id = ?', (doc_id,))
+                self._db.executemany('INSERT INTO pages (text, id, page) VALUES (?, ?, ?)', [(text, doc_id, page) for page, text in enumerate(texts)])
+                self._db.execute('INSERT OR REPLACE INTO documents VALUES (?, ?, ?, ?)', (doc_id, title, kind, version))
+            counts['indexed'] += 1
+
+        removed = [(doc_id,) for doc_id in versions if doc_id not in sources]
+        with self._lock, self._db:
+            self._db.executemany('DELETE FROM pages WHERE id = ?', removed)
+            self._db.executemany('DELETE FROM documents WHERE id = ?', removed)
+            self._db.executemany('DELETE FROM unavailable WHERE id = ?', removed)
+            # The index only counts as fresh once every document was read or refused, so an outage is retried rather than kept for a day
+            if counts['failed'] == 0:
+                self._db.execute("INSERT OR REPLACE INTO meta VALUES ('updated', ?)", (str(time.time()),))
+        counts['removed'] = len(removed)
+        return counts
+
+    @staticmethod
+    def _permanent(error: requests.HTTPError) -> bool:
+        # Client errors will not change on a retry, except timeouts and rate limits
+        # - An error without a response is a file storage no longer signs
+        status = error.response.status_code if error.response is not None else 404
+        return 400 <= status < 500 and status not in (408, 429)
+
+    def search(self, query: str, kinds: list | None = None, limit: int = 20) -> list:
+        # Pages ranked by BM25, every word must match and the last one may be a prefix of a longer word
+        words = re.findall(r'\w+', query.lower())
+        if not words:
+            return []
+        match = ' '.join(f'"{word}"' for word in words) + '*'
+        sql = (
+            "SELECT d.id, d.title, d.kind, p.page, snippet(pages, 0, '**', '**', '...', 12) "
+            'FROM pages p JOIN documents d ON d.id = p.id WHERE pages MATCH ?'
+        )
+        params = [match]
+        if kinds:
+            sql += f' AND d.kind IN ({", ".join("?" * len(kinds))})'
+            params += kinds
+        sql += ' ORDER BY bm25(pages) LIMIT ?'
+        params.append(limit)
+        with self._lock:
+            rows = self._db.execute(sql, params).fetchall()
+        return [{'id': doc_id, 'title': title, 'kind': kind, 'page': page, 'snippet': ' '.join(snippet.split())} for doc_id, title, kind, page, snippet in rows]
+
+
+@st.cache_resource
+def get_search_index() -> SearchIndex:
+    return SearchIndex(os.path.join(tempfile.gettempdir(), '49sqn_search.sqlite3'))
+
+
+def update_search_index(job, index, sources):
+    return index.update(sources, progress=job.update)
+
+
+def refresh_search_index(loader, force: bool = False) -> None:
+    # Starts a background update when files have changed or the index is over a day old
+    # - A forced update while one is running indexes the new sources in another pass once it finishes
+    index = get_search_index()
+    runner = get_background_runner()
+    job = runner.get('search_index')
+    recent = job is not None and (not job.done or time.time() - job.finished < index.RETRY_INTERVAL)
+    if force or (index.is_stale() and not recent):
+        runner.submit('search_index', 'Indexing documents', update_search_index, index, loader.search_sources(), rerun=force)
@@ -0,0 +1,66 @@
+import streamlit as st
+
+import threading
+import time
+
+
+class SharedData:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        self._entries = {}
+        # Bumped by invalidate, a load that started before the latest invalidate returns its result without storing it
+        self._generations = {}
+
+    def get(self, key, loader, ttl: float | None = None):
+        # Fast path, a fresh entry is a plain dictionary lookup
+        entry = self._entries.get(key)
+        if entry is not None and not self._expired(entry):
+            return entry[1]
+
+        # Only one session loads a resource, the others wait for its result
+        # - Each key lock counts the sessions using it, so it is only dropped when none of them still hold or wait on it
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, [threading.Lock(), 0])
+            key_lock[1] += 1
+        try:
+            with key_lock[0]:
+                entry = self._entries.get(key)
+                if entry is not None and not self._expired(entry):
+                    return entry[1]
+                with self._lock:
+                    generation = self._generations.get(key, 0)
+                value = loader()
+                expires_at = None if ttl is None else time.monotonic() + ttl
+                with self._lock:
+                    if self._generations.get(key, 0) == generation:
+                        self._entries[key] = (expires_at, value)
+                    self._evict_expired()
+                return value
+        finally:
+            with self._lock:
+                key_lock[1] -= 1
+                if key_lock[1] == 0 and key not in self._entries:
+                    self._key_locks.pop(key, None)
+
+    def invalidate(self, *keys) -> None:
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+                self._generations[key] = self._generations.get(key, 0) + 1
+
+    def _evict_expired(self) -> None:
+        # Keys that are never read again, such as old file versions, would otherwise stay in memory
+        for key in [key for key, entry in self._entries.items() if self._expired(entry)]:
+            self._entries.pop(key)
+            if self._key_locks.get(key, (None, 0))[1] == 0:
+                self._key_locks.pop(key, None)
+
+    @staticmethod
+    def _expired(entry: tuple) -> bool:
+        return entry[0] is not None and entry[0] <= time.monotonic()
+
+
+@st.cache_resource
+def get_shared_data() -> SharedData:
+    return SharedData()
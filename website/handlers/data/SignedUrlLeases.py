@@ -0,0 +1,36 @@
+import streamlit as st
+
+import threading
+import time
+
+
+class SignedUrlLeases:
+    EXPIRY = 3600
+    RENEW_BEFORE = 600  # seconds of validity a handed out URL must have left
+
+    def __init__(self) -> None:
+        # Signed storage URLs by (bucket, path), shared by every session until they are close to expiring
+        self._leases = {}
+        self._lock = threading.Lock()
+
+    def sign(self, supabase, bucket: str, files: list) -> list:
+        # Sets file['signedURL'] on each listing entry, re-signing every missing or expiring URL in one batched call
+        now = time.time()
+        with self._lock:
+            expiring = [file['path'] for file in files if self._leases.get((bucket, file['path']), (None, 0))[1] - now < self.RENEW_BEFORE]
+            if expiring:
+                for signed in supabase.create_signed_urls(bucket, expiring, expires_in=self.EXPIRY):
+                    if signed.get('signedURL'):
+                        self._leases[(bucket, signed['path'])] = (signed['signedURL'], now + self.EXPIRY)
+            for file in files:
+                file['signedURL'] = self._leases.get((bucket, file['path']), (None, 0))[0]
+        return files
+
+    def revoke(self, bucket: str, path: str) -> None:
+        with self._lock:
+            self._leases.pop((bucket, path), None)
+
+
+@st.cache_resource
+def get_signed_url_leases() -> SignedUrlLeases:
+    return SignedUrlLeases()
@@ -0,0 +1,143 @@
+import csv
+import hashlib
+import io
+import json
+import threading
+import time
+
+import requests
+
+from handlers.data.TrainingProgram import program_label, program_path
+
+
+class StorageManifest:
+    NAME = '_manifest.json'
+    ACTIVE_PROGRAMS = 'active_training_programs.csv'
+    ATTEMPTS = 3
+    REBUILD_INTERVAL = 86400
+    # Process wide, so sessions never interleave their read, change and write of a manifest
+    # - Held by callers whose own read, check and upload of a file must not interleave with another session's either
+    lock = threading.RLock()
+
+    def __init__(self, supabase, blobs, leases) -> None:
+        # One small JSON object per bucket with the name, content hash, size and flags of every file
+        # - Readers revalidate it with a conditional request instead of listing the bucket, so an unchanged bucket costs a 304
+        # - Every upload and delete made through the app updates it
+        self.supabase = supabase
+        self.blobs = blobs
+        self.leases = leases
+
+    def _read(self, bucket: str) -> dict | None:
+        file = {'path': self.NAME}
+        self.leases.sign(self.supabase, bucket, [file])
+        if not file['signedURL']:
+            return None
+        try:
+            return json.loads(self.blobs.path(f'{bucket}/{self.NAME}', file['signedURL'], max_age=0).read_bytes())
+        except requests.HTTPError as e:
+            # Only a missing manifest is rebuilt, any other failure must not overwrite the stored flags
+            if e.response is None or e.response.status_code not in (400, 404):
+                raise
+            return None
+
+    def load(self, bucket: str) -> dict:
+        # Missing manifests are built from a full listing, and every manifest is rebuilt daily to pick up files changed outside the app
+        manifest = self._read(bucket)
+        if manifest is None or time.time() - manifest.get('rebuilt', 0) > self.REBUILD_INTERVAL:
+            manifest = self.rebuild(bucket)
+        return manifest
+
+    def rebuild(self, bucket: str) -> dict:
+        with self.lock:
+            manifest = self.build(bucket, self._read(bucket))
+            self.save(bucket, manifest)
+        return manifest
+
+    def build(self, bucket: str, previous: dict | None = None) -> dict:
+        files = {}
+        for obj in self.supabase.list_objects(bucket, ttl='0s'):
+            # Folders, such as program history, have no id and are not files of the bucket
+            if obj['name'] == self.NAME or obj.get('id') is None:
+                continue
+            metadata = obj.get('metadata') or {}
+            files[obj['name']] = {
+                # Storage eTags are the MD5 of the content for single part uploads, the same hash record_upload uses
+                'hash': (metadata.get('eTag') or '').strip('"') or obj.get('updated_at'),
+                'size': metadata.get('size'),
+                'updated_at': obj.get('updated_at'),
+            }
+        if previous is not None:
+            for name, entry in previous['files'].items():
+                if name in files and 'active' in entry:
+                    files[name]['active'] = entry['active']
+        # set_active writes the CSV before the manifest, so its flags win over a previous manifest that may have missed the change
+        if self.ACTIVE_PROGRAMS in files:
+            data = self.supabase.client.storage.from_(bucket).download(self.ACTIVE_PROGRAMS)
+            for row in csv.DictReader(io.StringIO(data.decode('utf-8'))):
+                if program_path(row['name']) in files:
+                    files[program_path(row['name'])]['active'] = row['active'].strip().lower() == 'true'
+        return {'version': previous['version'] + 1 if previous is not None else 0, 'rebuilt': time.time(), 'files': files}
+
+    def save(self, bucket: str, manifest: dict) -> None:
+        self.supabase.client.storage.from_(bucket).upload(
+            self.NAME,
+            json.dumps(manifest, indent=1).encode('utf-8'),
+            # max-age=0 so no CDN copy of the manifest outlives a write
+            file_options={'content-type': 'application/json', 'cache-control': '0', 'x-upsert': 'true'}
+        )
+
+    def update(self, bucket: str, change) -> dict:
+        # The write is refused if another process wrote since the load, the change is then applied again to their manifest
+        with self.lock:
+            for _ in range(self.ATTEMPTS):
+                manifest = self.load(bucket)
+                version = manifest['version']
+                change(manifest['files'])
+                manifest['version'] = version + 1
+                manifest['updated'] = time.time()
+                if (self._read(bucket) or {}).get('version') != version:
+                    continue
+                self.save(bucket, manifest)
+                return manifest
+        raise RuntimeError(f'The {bucket} manifest kept changing while it was being updated')
+
+    def record_or_rebuild(self, bucket: str, change) -> dict:
+        # For changes made after the file itself was stored or removed, a failed update falls back to a rebuild from the bucket listing
+        # - Raises only when the rebuild fails as well
+        try:
+            return change(self)
+        except Exception:
+            return self.rebuild(bucket)
+
+    def record_upload(self, bucket: str, name: str, data: bytes) -> dict:
+        def change(files):
+            files[name] = {**files.get(name, {}), 'hash': hashlib.md5(data).hexdigest(), 'size': len(data), 'updated_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())}
+        return self.update(bucket, change)
+
+    def record_delete(self, bucket: str, name: str) -> dict:
+        return self.update(bucket, lambda files: files.pop(name, None))
+
+    def set_active(self, bucket: str, flags: dict) -> dict:
+        def change(files):
+            for name, active in flags.items():
+                if name in files:
+                    files[name]['active'] = bool(active)
+        with self.lock:
+            files = self.load(bucket)['files']
+            change(files)
+            self.save_active(bucket, files)
+            return self.update(bucket, change)
+
+    def save_active(self, bucket: str, files: dict) -> None:
+        # Every program with its flag, so the flags survive a manifest that is lost or rebuilt
+        output = io.StringIO()
+        writer = csv.writer(output, lineterminator='\n')
+        writer.writerow(['name', 'active'])
+        for name, entry in sorted(files.items()):
+            if name != self.ACTIVE_PROGRAMS:
+                writer.writerow([program_label(name), bool(entry.get('active', False))])
+        self.supabase.client.storage.from_(bucket).upload(
+            self.ACTIVE_PROGRAMS,
+            output.getvalue().encode('utf-8'),
+            file_options={'content-type': 'text/csv', 'cache-control': '0', 'x-upsert': 'true'}
+        )
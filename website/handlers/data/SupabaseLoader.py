@@ -1,27 +1,125 @@
 import streamlit as st
 
+import io
 import re
 import json
+import time
+import pathlib
+import requests
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
 from st_supabase_connection import SupabaseConnection, execute_query
 
+from handlers.data.SharedData import get_shared_data
+from handlers.data.BlobCache import get_blob_cache
+from handlers.data.SignedUrlLeases import get_signed_url_leases
+from handlers.data.StorageManifest import StorageManifest
+from handlers.data.ProgramHistory import ProgramHistory
+from handlers.data.PermissionIndex import get_permission_index
+from handlers.data.UserDirectory import UserDirectory
+from handlers.data.TrainingProgram import TrainingProgram, merge_changes
+from handlers.data.LessonIndex import LessonIndex
+from handlers.data.TitleIndex import TitleIndex
+
+
+class MissingFile(requests.HTTPError):
+    # Storage signed no URL for a listed file, so pages handle it like any other failed download
+    pass
+
 
 class SupabaseLoader:
+    USERS_TTL = 60
+    # Bucket manifests are re-checked this often, their signed URLs are renewed separately by the lease manager
+    STORAGE_TTL = 3000
+    # Seconds after which a source still loading at startup is reported as slow
+    # - Only a label, the loads themselves are not bounded and end when their requests do
+    SLOW_AFTER = {'users': 10, 'syllabus': 2, 'training_programs': 5, 'lesson_plans': 5}
+
     def __init__(self) -> None:
         self.supabase = st.connection('supabase', type=SupabaseConnection, ttl='60s')
+        self.shared = get_shared_data()
+        self.blobs = get_blob_cache()
+        self.leases = get_signed_url_leases()
+        self.manifest = StorageManifest(self.supabase, self.blobs, self.leases)
+        self.history = ProgramHistory(self.supabase, self.blobs, self.leases, self.shared)
+        self.base_path = st.session_state.BASE_PATH
+        self.permissions = get_permission_index(self.base_path)
 
         self._ = st.session_state._
 
-        self.users = None
-        self.load_users()
-
+        # Independent sources start loading together, pages only wait for the ones they use
+        # - Startup loads run outside the script thread, so they must not use st.session_state
+        self.startup = {}
+        self.startup_timings = {}
+        self.startup_started = time.monotonic()
+        if st.user.is_logged_in:
+            self.startup = {name: get_startup_pool().submit(self._load, name) for name in self.SLOW_AFTER}
         self.user = self.get_user(st.user)
-        self.training_programs = self.get_training_programs()
-        self.syllabus = self.get_syllabus()
 
-    def load_users(self) -> None:
-        if self.users is None:
-            self.users = execute_query(self.supabase.table('users').select('*'), ttl='60s')
-            self.users.data.sort(key=lambda x: x['permissions'][0] if len(x['permissions']) > 0 else 'user')
+    def _load(self, name: str) -> None:
+        start = time.perf_counter()
+        try:
+            getattr(self, name)
+        except Exception as e:
+            self.startup_timings[name] = f'failed after {(time.perf_counter() - start) * 1000:.0f} ms: {e}'
+            raise
+        self.startup_timings[name] = f'{(time.perf_counter() - start) * 1000:.0f} ms'
+
+    def ready(self, name: str) -> bool:
+        # Never blocks, a failed load counts as ready so the page reports its error when it reads the source
+        future = self.startup.get(name)
+        return future is None or future.done()
+
+    def slow(self, name: str) -> bool:
+        return not self.ready(name) and time.monotonic() - self.startup_started > self.SLOW_AFTER[name]
+
+    def invalidate(self, *resources: str) -> None:
+        self.shared.invalidate(*resources)
+        if 'users' in resources and self.user:
+            self.user = self.get_user(st.user)
+
+    @property
+    def users(self) -> UserDirectory:
+        return self.shared.get('users', self.load_users, self.USERS_TTL)
+
+    @property
+    def training_programs(self) -> list:
+        return self.leases.sign(self.supabase, 'training_programs', self.shared.get('training_programs', self.get_training_programs, self.STORAGE_TTL))
+
+    @property
+    def syllabus(self) -> dict:
+        return self.shared.get('syllabus', self.get_syllabus)
+
+    @property
+    def manuals(self) -> dict:
+        return self.shared.get('manuals', self.get_manuals)
+
+    @property
+    def lesson_plans(self) -> list:
+        return self.leases.sign(self.supabase, 'lesson_plans', self.shared.get('lesson_plans', self.get_lesson_plans, self.STORAGE_TTL))
+
+    @property
+    def lesson_index(self) -> LessonIndex:
+        lesson_plans, syllabus = self.lesson_plans, self.syllabus
+        index = self.shared.get('lesson_index', lambda: LessonIndex(lesson_plans, syllabus))
+        # Rebuild once the listing or syllabus it was built from has been replaced
+        if index.lesson_plans is not lesson_plans or index.syllabus is not syllabus:
+            self.shared.invalidate('lesson_index')
+            index = self.shared.get('lesson_index', lambda: LessonIndex(lesson_plans, syllabus))
+        return index
+
+    def title_index(self, name: str) -> TitleIndex:
+        # Title search over 'manuals', 'syllabus' or 'lesson_plans', rebuilt once that source has been replaced
+        source = getattr(self, name)
+        build = lambda: (source, TitleIndex([file['path'].removesuffix('.pdf') for file in source] if name == 'lesson_plans' else source))
+        built_from, index = self.shared.get(('title_index', name), build)
+        if built_from is not source:
+            self.shared.invalidate(('title_index', name))
+            built_from, index = self.shared.get(('title_index', name), build)
+        return index
+
+    def load_users(self) -> UserDirectory:
+        return UserDirectory(execute_query(self.supabase.table('users').select('*'), ttl=0).data)
 
     def get_user(self, user) -> dict | None:
         if not user.is_logged_in:
@@ -32,23 +130,142 @@ class SupabaseLoader:
                 st.stop()
             return None
 
-        for u in self.users.data:
-            if u['email'] == user.email.lower():
-                st.session_state.beta_features = 'beta_features' in u['settings']
-                u['permissions_expanded'] = [perm for perms in u['permissions'] for perm in json.load(open(st.session_state.BASE_PATH + '/resources/configurations/permission_structure.json', 'r'))[perms]]
-                return u
+        u = self.users.get(user.email.lower())
+        if u is None:
+            return None
+
+        # Copy the shared record so per-session fields never leak between sessions
+        u = dict(u)
+        st.session_state.beta_features = 'beta_features' in u['settings']
+        u['permissions_expanded'] = self.permissions.expand(u['permissions'])
+        return u
+
+    def has_permission(self, capability: str) -> bool:
+        return self.user is not None and self.permissions.allows(self.user['permissions'], capability)
+
+    def list_bucket(self, bucket: str) -> list:
+        # Read from the bucket manifest rather than listing storage, an unchanged manifest is a single 304
+        # - The content hash is the version, so parsed and rendered files stay cached until the content changes
+        # - Files carry their active flag too, so no extra file is downloaded to find the active programs
+        files = self.manifest.load(bucket)['files']
+        return [
+            {'path': name, 'bucket': bucket, 'version': entry['hash'], 'size': entry.get('size'), 'active': entry.get('active', False)}
+            for name, entry in sorted(files.items())
+            if name != StorageManifest.ACTIVE_PROGRAMS
+        ]
 
-        return None
-    
     def get_training_programs(self) -> list:
-        return self.supabase.create_signed_urls(
-            'training_programs',
-            [file['name'] for file in self.supabase.list_objects('training_programs', ttl='0s')],
-            expires_in=3600
+        return self.list_bucket('training_programs')
+
+    def get_training_program(self, file: dict) -> TrainingProgram:
+        return self.shared.get(
+            ('training_program', file['path'], file.get('version')),
+            lambda: TrainingProgram.from_csv(self.get_file(file)),
+            self.STORAGE_TTL
         )
-    
+
+    def save_training_program(self, file: dict, base: pd.DataFrame, changes: dict) -> list:
+        # Version checked save of the cells changed since base was loaded
+        # - If the program was saved by someone else in the meantime, the changes are merged into their copy and cells both edited are returned
+        # - The manifest lock is held from the version check to the manifest update, so two sessions never merge against the same version
+        with self.manifest.lock:
+            current = base
+            version = self.manifest.load('training_programs')['files'].get(file['path'], {}).get('hash')
+            if version is not None and version != file.get('version'):
+                current = pd.read_csv(io.BytesIO(self.get_file({**file, 'version': version})))
+            if not self.history.snapshots(file['path']):
+                # Keep the state before the first save through the editor as the start of the history
+                self.history.save(file['path'], TrainingProgram(current), version or file['version'])
+            merged, conflicts = merge_changes(base, current, changes)
+            try:
+                program = TrainingProgram(merged)
+            except (ValueError, TypeError) as e:
+                raise ValueError(f'The edited program could not be read, check the week dates: {e}') from e
+
+            csv_bytes = io.BytesIO(merged.to_csv(index=False).encode('utf-8'))
+            csv_bytes.name = file['path']
+            csv_bytes.type = 'text/csv'
+            self.supabase.upload(bucket_id='training_programs', source='local', file=csv_bytes, destination_path=f'/{file["path"]}', overwrite='true')
+            try:
+                try:
+                    manifest = self.manifest.record_or_rebuild('training_programs', lambda manifest: manifest.record_upload('training_programs', file['path'], csv_bytes.getvalue()))
+                except Exception as e:
+                    raise RuntimeError('The changes were saved, but the list of training programs could not be updated. Use **Rebuild File List** to update it.') from e
+            finally:
+                self.invalidate('training_programs')
+        self.history.save(file['path'], program, manifest['files'][file['path']]['hash'])
+        return conflicts
+
+    def get_snapshot(self, snapshot: dict) -> pd.DataFrame:
+        # Records of one history snapshot, snapshots never change so they are cached by object name
+        file = {'bucket': ProgramHistory.BUCKET, 'path': snapshot['object'], 'version': snapshot['object']}
+        return self.shared.get(('snapshot', snapshot['object']), lambda: pd.read_parquet(self.file_path(file)), self.STORAGE_TTL)
+
+    def file_path(self, file: dict) -> pathlib.Path:
+        # Storage objects are cached on disk by bucket, path and version rather than by signed URL
+        # - The URL is renewed first if it is close to expiring, and re-signed once if storage still rejects it
+        key = f'{file["bucket"]}/{file["path"]}'
+        self.leases.sign(self.supabase, file['bucket'], [file])
+        try:
+            return self.blobs.path(key, self._signed_url(file), file.get('version'))
+        except requests.HTTPError as e:
+            if e.response is None or e.response.status_code not in (400, 401, 403):
+                raise
+            self.leases.revoke(file['bucket'], file['path'])
+            self.leases.sign(self.supabase, file['bucket'], [file])
+            return self.blobs.path(key, self._signed_url(file), file.get('version'))
+
+    def _signed_url(self, file: dict) -> str:
+        if not file['signedURL']:
+            self.forget(file)
+            raise MissingFile(f'{file["path"]} is no longer in storage')
+        return file['signedURL']
+
+    def forget(self, file: dict) -> None:
+        # Storage signs no URL for a file that is gone, e.g. one deleted outside the app while the manifest still lists it
+        # - The entry is dropped from the manifest, since invalidating the listing alone would re-read the same stale manifest
+        try:
+            self.manifest.record_or_rebuild(file['bucket'], lambda manifest: manifest.record_delete(file['bucket'], file['path']))
+        except Exception:
+            # The daily rebuild drops it otherwise
+            pass
+        self.invalidate(file['bucket'])
+
+    def get_file(self, file: dict) -> bytes:
+        # Fetched through file_path first so an expired URL is renewed, then read from the shared in-memory copy
+        self.file_path(file)
+        return self.blobs.get(f'{file["bucket"]}/{file["path"]}', file['signedURL'], file.get('version'))
+
+    def get_guide(self, name: str) -> bytes:
+        url = self.syllabus[name]['url']
+        return self.blobs.get(url, url)
+
+    def guide_path(self, name: str) -> pathlib.Path:
+        url = self.syllabus[name]['url']
+        return self.blobs.path(url, url)
+
+    def get_lesson_plans(self) -> list:
+        lesson_plans = self.list_bucket('lesson_plans')
+        lesson_plans.sort(key=lambda x: (not x['path'].endswith('Template.pdf'), x['path']))
+        return lesson_plans
+
+    def get_manuals(self) -> dict:
+        with open(self.base_path + '/resources/configurations/manuals.json', 'r') as file:
+            return dict(sorted(json.load(file).items()))
+
+    def search_sources(self) -> dict:
+        # Every searchable document by id, with a callable that fetches it into the disk cache
+        sources = {}
+        for name, url in self.manuals.items():
+            sources[f'manual:{name}'] = (name, 'manual', lambda url=url: self.blobs.path(url, url))
+        for name in self.syllabus:
+            sources[f'guide:{name}'] = (name, 'guide', lambda name=name: self.guide_path(name))
+        for file in self.lesson_plans:
+            sources[f'lesson_plan:{file["path"]}'] = (file['path'].removesuffix('.pdf'), 'lesson_plan', lambda file=file: self.file_path(file))
+        return sources
+
     def get_syllabus(self) -> dict:
-        syllabus_path = st.session_state.BASE_PATH + '/resources/configurations/syllabus.json'
+        syllabus_path = self.base_path + '/resources/configurations/syllabus.json'
 
         with open(syllabus_path, 'r') as file:
             raw_syllabus = json.load(file)
@@ -60,4 +277,22 @@ class SupabaseLoader:
             for number, details in lessons.items()
         }
 
-        return dict(sorted(flat_syllabus.items()))
\ No newline at end of file
+        return dict(sorted(flat_syllabus.items()))
+
+
+@st.cache_resource
+def get_startup_pool() -> ThreadPoolExecutor:
+    return ThreadPoolExecutor(max_workers=8, thread_name_prefix='startup')
+
+
+@st.fragment(run_every=1)
+def startup_status(*names: str) -> None:
+    # Placeholder for content waiting on startup sources, the page reruns once they have all loaded
+    loader = st.session_state.SUPABASE_CONNECTION
+    waiting = [name for name in names if not loader.ready(name)]
+    if not waiting:
+        st.rerun()
+    st.caption(f'*Loading {", ".join(name.replace("_", " ") for name in waiting)}...*')
+    slow = [name for name in waiting if loader.slow(name)]
+    if slow:
+        st.warning(f'Loading the {" and ".join(name.replace("_", " ") for name in slow)} is taking longer than usual', icon=':material/hourglass_top:')
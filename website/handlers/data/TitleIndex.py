@@ -0,0 +1,59 @@
+import re
+from collections import Counter
+
+
+def compact(text: str) -> str:
+    # 'Year 1 DRL 1.2 - Drill' -> 'year1drl12drill', so 'drl12' and 'DRL 1.2' match the same way
+    return re.sub(r'[\W_]+', '', text.lower())
+
+
+def trigrams(text: str) -> set:
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class TitleIndex:
+    MIN_SIMILARITY = 0.6
+
+    def __init__(self, titles) -> None:
+        self.titles = list(titles)
+        self.compact = [compact(title) for title in self.titles]
+        self.words = [re.findall(r'\w+', title.lower()) for title in self.titles]
+        self.postings = {}
+        for position, text in enumerate(self.compact):
+            for gram in trigrams(text):
+                self.postings.setdefault(gram, []).append(position)
+
+    def _score(self, position: int, query: str, words: list, similarity: float) -> float:
+        text = self.compact[position]
+        at = text.find(query)
+        if at == 0:
+            return 3.0
+        if at > 0:
+            return 2.0
+        if all(any(word.startswith(part) for word in self.words[position]) for part in words):
+            return 1.5
+        return similarity
+
+    def search(self, query: str, limit: int | None = None) -> list:
+        # Titles ranked by how well they match: prefix, then substring, then word prefixes, then trigram similarity for typos
+        # - An empty query returns every title in its original order
+        query_compact = compact(query)
+        if not query_compact:
+            return self.titles[:limit]
+        words = re.findall(r'\w+', query.lower())
+
+        if len(query_compact) < 3:
+            candidates = {position: 0.0 for position, text in enumerate(self.compact) if query_compact in text}
+        else:
+            grams = trigrams(query_compact)
+            counts = Counter(position for gram in grams for position in self.postings.get(gram, ()))
+            candidates = {position: count / len(grams) for position, count in counts.items()}
+
+        scored = [(-self._score(position, query_compact, words, similarity), position) for position, similarity in candidates.items()]
+        # Close trigram matches are only used when nothing matches directly, e.g. for typos
+        if any(score <= -1 for score, _ in scored):
+            scored = [(score, position) for score, position in scored if score <= -1]
+        else:
+            scored = [(score, position) for score, position in scored if -score >= self.MIN_SIMILARITY]
+        scored.sort()
+        return [self.titles[position] for _, position in scored[:limit]]
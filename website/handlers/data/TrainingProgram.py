@@ -0,0 +1,242 @@
+import datetime
+import io
+
+import numpy as np
+import pandas as pd
+
+
+def program_label(path: str) -> str:
+    # '2025_1.csv' -> '2025: Term 1'
+    year, term = path.removesuffix('.csv').split('_')[:2]
+    return f'{year}: Term {term}'
+
+
+def program_path(label: str) -> str:
+    # '2025: Term 1' -> '2025_1.csv'
+    return label.replace(': ', '_').replace('Term ', '') + '.csv'
+
+
+def _same(a, b) -> bool:
+    return (pd.isna(a) and pd.isna(b)) or a == b
+
+
+def cell_changes(frame: pd.DataFrame, edited_rows: dict) -> dict:
+    # {(row, column): value} for every cell a data editor delta actually changed, cleared cells become None
+    changes = {}
+    for row, columns in edited_rows.items():
+        for column, value in columns.items():
+            value = None if value is None or value == '' else value
+            if not _same(frame.at[int(row), column], value):
+                changes[(int(row), column)] = value
+    return changes
+
+
+def merge_changes(base: pd.DataFrame, current: pd.DataFrame, changes: dict) -> tuple:
+    # Applies changes made against base onto current, the latest saved frame
+    # - A cell someone else has changed since base keeps their value and is returned as a conflict
+    merged = current.astype(object)
+    conflicts = []
+    for (row, column), value in changes.items():
+        if column not in merged.columns or row >= len(merged):
+            conflicts.append((row, column, None))
+            continue
+        theirs = merged.at[row, column]
+        if not _same(theirs, base.at[row, column]) and not _same(theirs, value):
+            conflicts.append((row, column, theirs))
+            continue
+        merged.at[row, column] = value
+    return merged, conflicts
+
+
+def diff_records(old: pd.DataFrame, new: pd.DataFrame) -> pd.DataFrame:
+    # One row per changed field between two record sets, dress changes are reported once per week
+    merged = old.astype(object).merge(new.astype(object), on=RECORD_KEYS, how='outer', suffixes=('_before', '_after'))
+    changes = []
+    for field in ('dress', *RECORD_FIELDS):
+        rows = merged.drop_duplicates('week') if field == 'dress' else merged
+        before, after = rows[f'{field}_before'], rows[f'{field}_after']
+        changed = rows[before.fillna('') != after.fillna('')]
+        changes.append(pd.DataFrame({
+            'week': changed['week'],
+            'year_group': None if field == 'dress' else changed['year_group'],
+            'period': None if field == 'dress' else changed['period'],
+            'field': field,
+            'before': changed[f'{field}_before'],
+            'after': changed[f'{field}_after'],
+        }))
+    return pd.concat(changes, ignore_index=True).sort_values(['week', 'year_group', 'period'], na_position='first', ignore_index=True)
+
+
+def _cell(value) -> str | None:
+    return value if isinstance(value, str) else None
+
+
+def _extend_rows(frame: pd.DataFrame, column: str, values: list, count: int) -> pd.DataFrame:
+    # Keeps each matching row and the count - 1 rows after it
+    if len(values) == 0:
+        return frame
+    selected = np.flatnonzero(frame[column].isin(values).to_numpy())
+    positions = (selected[:, None] + np.arange(count)).ravel()
+    return frame.iloc[positions[positions < len(frame)]].reset_index(drop=True)
+
+
+def _merge_lesson_rows(frame: pd.DataFrame) -> pd.DataFrame:
+    # Joins each lesson code row with the title row below it, leaving the instructor row as is
+    tops = np.arange(2, len(frame) - 1, 3)
+    code = frame.iloc[tops].to_numpy(dtype=str)
+    title = frame.iloc[tops + 1].to_numpy(dtype=str)
+    merged = np.char.add(code, np.where(title == 'nan', '', np.char.add(' ', title)))
+    merged[merged == 'nan'] = ''
+
+    values = frame.to_numpy(dtype=object)
+    values[tops] = merged
+    keep = np.ones(len(frame), dtype=bool)
+    keep[tops + 1] = False
+    return pd.DataFrame(values[keep], columns=frame.columns)
+
+
+class Period:
+    def __init__(self, year_group: str, number: int, code: str | None, title: str | None, instructor: str | None) -> None:
+        self.year_group = year_group
+        self.number = number
+        self.code = code
+        self.title = title
+        self.instructor = instructor
+
+    @property
+    def is_empty(self) -> bool:
+        return self.code is None and self.title is None and self.instructor is None
+
+    @property
+    def lesson_code(self) -> str | None:
+        return self.code.split('-')[0].strip() if self.code is not None else None
+
+    @property
+    def is_lesson(self) -> bool:
+        # Periods without a syllabus lesson have no lesson plan or guide to open
+        return self.code is not None and not self.code.strip().startswith('Other')
+
+
+class Week:
+    def __init__(self, column: str, date: datetime.date, date_text: str, dress: str | None, periods: dict) -> None:
+        self.column = column
+        self.label = column.split('.')[0]
+        self.date = date
+        self.date_text = date_text
+        self.dress = dress
+        self.periods = periods
+
+
+# Normalized layout of a program: one record per week, year group and period
+RECORD_KEYS = ['week', 'year_group', 'period']
+RECORD_FIELDS = ['code', 'title', 'instructor']
+RECORD_COLUMNS = ['week', 'column', 'dress', 'year_group', 'period', 'period_name', *RECORD_FIELDS]
+
+
+class TrainingProgram:
+    DATE_FORMAT = '%d/%m/%Y'
+    HIGHLIGHT_STYLE = 'background-color: #ff4500; color: black; font-weight: bold;'
+
+    def __init__(self, frame: pd.DataFrame) -> None:
+        # Layout of the CSV grid:
+        # - Row 0 holds the week dates and row 1 the dress
+        # - Then for each year group and period, three rows of lesson code, title and instructor
+        self.frame = frame
+        self.year_groups = [year for year in frame['Year Group'].unique() if isinstance(year, str)]
+        self.period_names = [period for period in frame['Period'].unique() if isinstance(period, str)]
+
+        self.weeks = []
+        for column in frame.columns[2:]:
+            cells = frame[column].tolist()
+            periods = {}
+            row = 2
+            for year in self.year_groups:
+                periods[year] = []
+                for number in range(1, len(self.period_names) + 1):
+                    code, title, instructor = (_cell(cells[i]) if i < len(cells) else None for i in range(row, row + 3))
+                    periods[year].append(Period(year, number, code, title, instructor))
+                    row += 3
+            self.weeks.append(Week(
+                column,
+                datetime.datetime.strptime(cells[0], self.DATE_FORMAT).date(),
+                cells[0],
+                _cell(cells[1]),
+                periods
+            ))
+
+    @classmethod
+    def from_csv(cls, data: bytes) -> 'TrainingProgram':
+        return cls(pd.read_csv(io.BytesIO(data)))
+
+    @classmethod
+    def from_records(cls, records: pd.DataFrame) -> 'TrainingProgram':
+        # Rebuilds the CSV grid from records, each period's code row carries its year group and period name
+        records = records.astype(object).where(records.notna(), np.nan)
+        weeks = records.drop_duplicates('column')
+        years = list(dict.fromkeys(records['year_group']))
+        periods = records.drop_duplicates('period').sort_values('period')
+        column_at = {column: at for at, column in enumerate(weeks['column'], 2)}
+        period_at = {number: at for at, number in enumerate(periods['period'])}
+        year_at = {year: at for at, year in enumerate(years)}
+
+        grid = np.full((2 + len(years) * len(periods) * 3, len(column_at) + 2), np.nan, dtype=object)
+        grid[0, 2:] = [date.strftime(cls.DATE_FORMAT) for date in weeks['week']]
+        grid[1, 2:] = weeks['dress'].to_numpy()
+        tops = 2 + (np.arange(len(years))[:, None] * len(periods) + np.arange(len(periods))).ravel() * 3
+        grid[tops, 0] = np.repeat(years, len(periods))
+        grid[tops, 1] = np.tile(periods['period_name'].to_numpy(), len(years))
+
+        rows = 2 + (records['year_group'].map(year_at).to_numpy() * len(periods) + records['period'].map(period_at).to_numpy()) * 3
+        columns = records['column'].map(column_at).to_numpy()
+        for offset, field in enumerate(RECORD_FIELDS):
+            grid[rows + offset, columns] = records[field].to_numpy()
+        return cls(pd.DataFrame(grid, columns=['Year Group', 'Period', *column_at]))
+
+    def records(self) -> pd.DataFrame:
+        records = pd.DataFrame([
+            (week.date, week.column, week.dress, year, period.number, self.period_names[period.number - 1], period.code, period.title, period.instructor)
+            for week in self.weeks
+            for year in self.year_groups
+            for period in week.periods[year]
+        ], columns=RECORD_COLUMNS)
+        records['period'] = records['period'].astype('int16')
+        return records.astype({column: 'category' for column in ('column', 'dress', 'year_group', 'period_name', 'instructor')})
+
+    def next_week(self, today: datetime.date) -> Week:
+        # The first week on or after today, or the last week once the program has finished
+        return next((week for week in self.weeks if week.date >= today), self.weeks[-1])
+
+    def lessons_for(self, instructor: str, today: datetime.date) -> list:
+        return [
+            (week, period)
+            for week in self.weeks if week.date >= today
+            for year in self.year_groups
+            for period in week.periods[year]
+            if period.instructor == instructor
+        ]
+
+    def display_frame(self, years: list = (), periods: list = (), weeks: list = ()) -> pd.DataFrame:
+        # Grid shown on the Training Program page, with lesson codes and titles in one cell
+        frame = _extend_rows(self.frame, 'Year Group', years, 3)
+        frame = _extend_rows(frame, 'Period', periods, 3)
+        if len(weeks) > 0:
+            frame = frame[['Year Group', 'Period', *weeks]]
+
+        frame = _merge_lesson_rows(frame).fillna(' ')
+
+        # Only label the first row of each year group
+        year_groups = frame['Year Group']
+        frame.loc[year_groups.duplicated() & (year_groups != ' '), 'Year Group'] = ''
+        return frame
+
+    def display_styles(self, frame: pd.DataFrame, highlight: list, column: str, colors: dict, border_color: str) -> pd.DataFrame:
+        # CSS for every cell of a display frame, classed by the lesson code prefix of each cell
+        values = pd.Series(frame.to_numpy(dtype=str).ravel())
+        lesson_styles = {code: f'background-color: {color}; color: black;' for code, color in colors.items()}
+        styles = values.str.split(n=1).str[0].map(lesson_styles).fillna('').to_numpy(dtype=object)
+        styles = np.where(values.isin(highlight), self.HIGHLIGHT_STYLE + ' ', '').astype(object) + styles
+
+        styles = styles.reshape(frame.shape)
+        if column in frame.columns:
+            styles[:, frame.columns.get_loc(column)] = f'background-color: {border_color}; ' + styles[:, frame.columns.get_loc(column)]
+        return pd.DataFrame(styles, index=frame.index, columns=frame.columns)
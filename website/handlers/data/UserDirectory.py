@@ -0,0 +1,11 @@
+class UserDirectory:
+    def __init__(self, rows: list) -> None:
+        # Stable view for tables, grouped by primary permission then name
+        self.data = sorted(rows, key=lambda x: (x['permissions'][0] if len(x['permissions']) > 0 else 'user', x['name'] or ''))
+
+        self.by_email = {row['email']: row for row in self.data}
+        self.emails = list(self.by_email)
+        self.names = list(dict.fromkeys(row['name'] for row in self.data if row['name']))
+
+    def get(self, email: str) -> dict | None:
+        return self.by_email.get(email)
@@ -35,6 +35,7 @@ with cols[1]:
                     .eq('email', st.session_state.SUPABASE_CONNECTION.user['email']),
                     ttl=0,
                 )
+                st.session_state.SUPABASE_CONNECTION.invalidate('users')
                 st.rerun()
     with tabs[1]:
         with st.form(key='app_settings', border=False, enter_to_submit=False):
@@ -51,4 +52,5 @@ with cols[1]:
                     .eq('email', st.session_state.SUPABASE_CONNECTION.user['email']),
                     ttl=0,
                 )
+                st.session_state.SUPABASE_CONNECTION.invalidate('users')
                 st.rerun()
\ No newline at end of file
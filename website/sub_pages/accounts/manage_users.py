@@ -1,7 +1,6 @@
 import streamlit as st
 import pandas as pd
 from st_supabase_connection import execute_query
-import json
 
 df = pd.DataFrame(st.session_state.SUPABASE_CONNECTION.users.data)
 cols = st.columns([3, 5, 1], gap='large')
@@ -20,6 +19,7 @@ def confirmation(email):
                 st.session_state.SUPABASE_CONNECTION.supabase.table('users').delete().eq('email' , email),
                 ttl=0
             )
+            st.session_state.SUPABASE_CONNECTION.invalidate('users')
             st.rerun()
 
 
@@ -38,7 +38,7 @@ with cols[0]:
                             use_container_width=True,
                             height=325)
 
-if 'manage_users' in st.session_state.SUPABASE_CONNECTION.user['permissions_expanded']:
+if st.session_state.SUPABASE_CONNECTION.has_permission('manage_users'):
     with cols[1]:
         st.write('### Manage Users')
         tabs = st.tabs(['Add Users', 'Delete Users', 'Edit Users'])
@@ -47,7 +47,7 @@ if 'manage_users' in st.session_state.SUPABASE_CONNECTION.user['permissions_expa
                 name = st.text_input('Name', placeholder='Name', max_chars=50, help='Enter the name of the new user')
                 email = st.text_input('Email', placeholder='Email', max_chars=50, help='Enter the email address of the new user')
                 discord_id = st.text_input('Discord ID', placeholder='Discord ID', max_chars=50, help='Enter the Discord ID of the new user')
-                permissions = st.multiselect('Permissions', options=json.load(open(st.session_state.BASE_PATH + '/resources/configurations/permission_structure.json', 'r')), placeholder='Select Permissions', help='Select the permissions for the new user')
+                permissions = st.multiselect('Permissions', options=st.session_state.SUPABASE_CONNECTION.permissions.role_names, placeholder='Select Permissions', help='Select the permissions for the new user')
                 if st.form_submit_button('Create User', help='Create a new user with the provided details'):
                     if 'Admin' in permissions and 'Admin' not in st.session_state.SUPABASE_CONNECTION.user['permissions']:
                         st.error('Cannot grant admin permissions')
@@ -62,26 +62,28 @@ if 'manage_users' in st.session_state.SUPABASE_CONNECTION.user['permissions_expa
                                     ),
                                     ttl=0
                                 )
+                                st.session_state.SUPABASE_CONNECTION.invalidate('users')
                                 st.rerun()
                             except Exception as e:
                                 st.error('Email already in use')
                         else:
                             st.error('Must provide an email address')
         with tabs[1]:
-            selected_email = st.selectbox('Select a User to Delete', [row['email'] for row in st.session_state.SUPABASE_CONNECTION.users.data])
-            if 'Admin' in [row['permissions'] for row in st.session_state.SUPABASE_CONNECTION.users.data if row['email'] == selected_email][0] and 'Admin' not in st.session_state.SUPABASE_CONNECTION.user['permissions'] and selected_email is not st.session_state.SUPABASE_CONNECTION.user['email']:
+            selected_email = st.selectbox('Select a User to Delete', st.session_state.SUPABASE_CONNECTION.users.emails)
+            if 'Admin' in st.session_state.SUPABASE_CONNECTION.users.get(selected_email)['permissions'] and 'Admin' not in st.session_state.SUPABASE_CONNECTION.user['permissions'] and selected_email is not st.session_state.SUPABASE_CONNECTION.user['email']:
                 st.error('Cannot delete an admin user')
             else:
                 if st.button('Delete User'):
                     confirmation(selected_email)
         with tabs[2]:
-            selected_email = st.selectbox('Select a User to Edit', [row['email'] for row in st.session_state.SUPABASE_CONNECTION.users.data])
-            if 'Admin' in [row['permissions'] for row in st.session_state.SUPABASE_CONNECTION.users.data if row['email'] == selected_email][0] and 'Admin' not in st.session_state.SUPABASE_CONNECTION.user['permissions'] and selected_email is not st.session_state.SUPABASE_CONNECTION.user['email']:
+            selected_email = st.selectbox('Select a User to Edit', st.session_state.SUPABASE_CONNECTION.users.emails)
+            selected_user = st.session_state.SUPABASE_CONNECTION.users.get(selected_email)
+            if 'Admin' in selected_user['permissions'] and 'Admin' not in st.session_state.SUPABASE_CONNECTION.user['permissions'] and selected_email is not st.session_state.SUPABASE_CONNECTION.user['email']:
                 st.error('Cannot edit an admin user')
             else:
-                name = st.text_input('Name', value=[row['name'] for row in st.session_state.SUPABASE_CONNECTION.users.data if row['email'] == selected_email][0], max_chars=50, help='Enter the name of the selected user')
-                discord_id = st.text_input('Discord ID', value=[row['discord_id'] for row in st.session_state.SUPABASE_CONNECTION.users.data if row['email'] == selected_email][0], max_chars=50, help='Enter the Discord ID of the selected user')
-                selected_permissions = st.multiselect('Permissions', options=json.load(open(st.session_state.BASE_PATH + '/resources/configurations/permission_structure.json', 'r')), default=[row['permissions'] for row in st.session_state.SUPABASE_CONNECTION.users.data if row['email'] == selected_email][0], help='Select the permissions for the selected user')
+                name = st.text_input('Name', value=selected_user['name'], max_chars=50, help='Enter the name of the selected user')
+                discord_id = st.text_input('Discord ID', value=selected_user['discord_id'], max_chars=50, help='Enter the Discord ID of the selected user')
+                selected_permissions = st.multiselect('Permissions', options=st.session_state.SUPABASE_CONNECTION.permissions.role_names, default=selected_user['permissions'], help='Select the permissions for the selected user')
                 if 'Admin' in selected_permissions and 'Admin' not in st.session_state.SUPABASE_CONNECTION.user['permissions']:
                     st.error('Cannot grant admin permissions')
                 else:
@@ -92,4 +94,5 @@ if 'manage_users' in st.session_state.SUPABASE_CONNECTION.user['permissions_expa
                             .eq('email', selected_email),
                             ttl=0,
                         )
+                        st.session_state.SUPABASE_CONNECTION.invalidate('users')
                         st.rerun()
@@ -1,62 +1,46 @@
 import streamlit as st
-import pandas as pd
 import requests
-import io
 import datetime
 from st_copy_to_clipboard import st_copy_to_clipboard
-import pymupdf
 
+from handlers.data.JobRunner import get_job_runner, job_status
+from handlers.data.LessonPlanRenderer import get_lesson_plan_renderer
+from handlers.data.SupabaseLoader import startup_status
 
-def get_training_program_names():        
-    training_program_files = []
-    for file in st.session_state.SUPABASE_CONNECTION.training_programs:
-        if file['path'] == 'active_training_programs.csv':
-            active_training_programs = pd.read_csv(get_data(file))
-    for file in st.session_state.SUPABASE_CONNECTION.training_programs:
-        if file['path'] != 'active_training_programs.csv':
-            file_name = file['path']
-            file_name = file_name.removesuffix('.csv')
-            split_file_name = file_name.split('_')
-            year = split_file_name[0]
-            term = split_file_name[1]
-            file_renamed = f'{year}: Term {term}'
-            for name, is_active in zip(active_training_programs['name'], active_training_programs['active']):
-                if name == file_renamed and is_active == True:
-                    training_program_files.append(file)
-    return training_program_files
 
+def get_training_program_names():
+    return [file for file in st.session_state.SUPABASE_CONNECTION.training_programs if file['active']]
+
+
+def build_weekly_pack(job, renderer, files, date):
+    # The job only keeps the render cache key, the pack itself stays in the renderer's output cache
+    renderer.build_weekly_pack(files, date, progress=job.update)
+    return renderer.weekly_pack_key(files, date)
 
-if st.session_state.SUPABASE_CONNECTION.user:
-    if 'files' not in st.session_state:
-        st.session_state.files = st.session_state.SUPABASE_CONNECTION.supabase.create_signed_urls('lesson_plans', [file['name'] for file in st.session_state.SUPABASE_CONNECTION.supabase.list_objects('lesson_plans', ttl='0s')], expires_in=3600)
 
+if st.session_state.SUPABASE_CONNECTION.user:
     try:
         @st.dialog('File Preview', width="large")
         def view_large_pdf(file_data, file_name):
-            try:
-                st.write(f'Viewing: *{file_name.removesuffix('.pdf')}*')
-                st.download_button('Download PDF', data=file_data, file_name=file_name+'.pdf', mime='application/octet-stream', icon=':material/download:')
-                st.pdf(file_data, height=750)
-            except AttributeError:
-                st.write(f'Viewing: *{file_name['path'].removesuffix('.pdf')}*')
-                st.download_button('Download PDF', data=file_data, file_name=file_name['path'], mime='application/octet-stream', icon=':material/download:')
-                st.pdf(file_data.getvalue(), height=750)
+            file_name = file_name['path'] if isinstance(file_name, dict) else file_name + '.pdf'
+            st.write(f'Viewing: *{file_name.removesuffix('.pdf')}*')
+            st.download_button('Download PDF', data=file_data, file_name=file_name, mime='application/octet-stream', icon=':material/download:')
+            st.pdf(file_data, height=750)
 
     except AttributeError:
         pass
 
-    @st.cache_data(ttl=3600)
     def get_data(file):
+        # Guides are named by their syllabus key, storage files are listing entries
+        if isinstance(file, str):
+            try:
+                return st.session_state.SUPABASE_CONNECTION.get_guide(file)
+            except requests.HTTPError:
+                return None
         try:
-            response = requests.get(st.session_state.SUPABASE_CONNECTION.syllabus[file]['url'])
-            if response.status_code == 200:
-                return io.BytesIO(response.content).getvalue()
-        except TypeError:
-            response = requests.get(file['signedURL'])
-            if response.status_code == 200:
-                return io.BytesIO(response.content)
-            st.session_state.pop('training_programs')
-            st.session_state.conn = None
+            return st.session_state.SUPABASE_CONNECTION.get_file(file)
+        except requests.HTTPError:
+            st.session_state.SUPABASE_CONNECTION.invalidate(file['bucket'])
             st.rerun()
 
     cols = st.columns([1, 13])
@@ -69,119 +53,105 @@ if st.session_state.SUPABASE_CONNECTION.user:
     '---'
     
     cols = st.columns(3, gap='large')
-    with cols[0]:
-        training_program_files = get_training_program_names()
-        df = pd.read_csv(get_data(training_program_files[-1]))
-        st.markdown('### Weekly Report', help='View the weekly report based on the training program')
-        next_date = None
-        for date in [(datetime.datetime.strptime(df['Week 1'][0], '%d/%m/%Y') + datetime.timedelta(weeks=i)).strftime('%d/%m/%Y') for i in range(len(df.columns) - 2)]:
-            if datetime.datetime.strptime(date, '%d/%m/%Y') >= datetime.datetime.strptime(datetime.datetime.now().strftime('%d/%m/%Y'), '%d/%m/%Y'):
-                next_date = date
-                break
-        for column in df.columns:
-            if df[column][0] == next_date:
-                break
-        text = [f'###### {column.split('.')[0]} - {df[column][0]}']
-        if isinstance(df[column][1], str):
-            text.append(f'###### Dress: {df[column][1]}')
-        else:
-            text.append('###### Dress: Not Specified')
-        num = 2
-        for year in df['Year Group'].unique():
-            if isinstance(year, str):
+    with cols[2]:
+        '### Quick Links'
+        st.page_link('sub_pages/resources/lesson_plans.py', label='Lesson Plans', icon=':material/book:', help='View and download lesson plans')
+        st.page_link('sub_pages/resources/documents.py', label='Documents', icon=':material/quick_reference_all:', help='View and download documents')
+        st.page_link('sub_pages/tools/training_program.py', label='Training Program', icon=':material/table:', help='View the training program')
+    # The header and links above are shown straight away, the report fills in once the program and lesson listings have loaded
+    waiting = [name for name in ('training_programs', 'lesson_plans', 'syllabus') if not st.session_state.SUPABASE_CONNECTION.ready(name)]
+    if waiting:
+        with cols[0]:
+            startup_status(*waiting)
+    else:
+        with cols[0]:
+            training_program_files = get_training_program_names()
+            program = st.session_state.SUPABASE_CONNECTION.get_training_program(training_program_files[-1])
+            st.markdown('### Weekly Report', help='View the weekly report based on the training program')
+            week = program.next_week(datetime.date.today())
+            lessons = {}
+            text = [f'###### {week.label} - {week.date_text}']
+            text.append(f'###### Dress: {week.dress or "Not Specified"}')
+            for year in program.year_groups:
                 text.append('')
                 text.append(f'#### {year}')
-                for i in range(len(df['Period'].unique())-1):
-                    if isinstance(df[column][num], str) or isinstance(df[column][num + 1], str) or isinstance(df[column][num + 2], str):
-                        text.append(f'- **Period {i + 1}:** {df[column][num]} - {df[column][num + 1]} with {df[column][num + 2]}'.replace('nan', 'Not Specified'))
+                for period in week.periods[year]:
+                    if not period.is_empty:
+                        lessons[len(text)] = period
+                        text.append(f'- **Period {period.number}:** {period.code or "Not Specified"} - {period.title or "Not Specified"} with {period.instructor or "Not Specified"}')
                     else:
                         if text[-1] != 'No Periods Specified':
                             text.append('No Periods Specified')
-                    num += 3
-        for index, text_ in enumerate(text):
-            if text_.startswith('-') and not text_.split('**')[2].split('-')[0].strip().startswith('Other') and not text_.split('**')[2].split('-')[0].strip().startswith('Not Specified'):
-                if st.button(text_.lstrip('-'), type='tertiary', help='View Lesson Plan/Guide', key=str(index)):
-                    file = next((f for f in st.session_state.files if text_.split('**')[2].split('-')[0].strip().startswith(f['path'].removesuffix('.pdf').removeprefix('Year ').removeprefix('1').removeprefix('2').removeprefix('3').removeprefix('4').split('-')[0].strip())), None)
-                    if file is None:
-                        file = next((f for f in st.session_state.SUPABASE_CONNECTION.syllabus if text_.split('**')[2].split('-')[0].strip() == (f.removeprefix('Year ').removeprefix('1').removeprefix('2').removeprefix('3').removeprefix('4').split('-')[0].strip())), None)
-                    view_large_pdf(get_data(file), file)
-            else:
-                st.write(text_.lstrip('-'))
-        if st.button('View Weekly Documents', use_container_width=True, help='Click to view all the lesson plans or guides for this week'):
-            files = {}
-            for text_ in text:
-                if text_.startswith('-') and not text_.split('**')[2].split('-')[0].strip().startswith('Other') and not text_.split('**')[2].split('-')[0].strip().startswith('Not Specified'):
-                    file = next((f for f in st.session_state.files if text_.split('**')[2].split('-')[0].strip().startswith(f['path'].removesuffix('.pdf').removeprefix('Year ').removeprefix('1').removeprefix('2').removeprefix('3').removeprefix('4').split('-')[0].strip())), None)
-                    if file is None:
-                        file = next((f for f in st.session_state.SUPABASE_CONNECTION.syllabus if text_.split('**')[2].split('-')[0].strip() == (f.removeprefix('Year ').removeprefix('1').removeprefix('2').removeprefix('3').removeprefix('4').split('-')[0].strip())), None)
-                    files[text_] = {'file': file, 'instructor': text_.split('with')[-1]}
-            merged_files = pymupdf.open()
-            for file in files:
-                replacements = {
-                    '[DATE]': df[column][0],
-                    '[INSTRUCTOR]': files[file]['instructor'],
-                    '[NAME]': files[file]['instructor'],
-                    '[NEXT_LESSON]': '',
-                    '[NEXT_INSTRUCTOR]': '',
-                    '[NEXT_LOCATION]': '',
-                    '[NEXT_TIMING]': '',
-                    '[NEXT_DRESS]': '',
-                }
-                pdf = pymupdf.open(stream=get_data(files[file]['file']))
-                for page in pdf:
-                    for key, value in replacements.items():
-                        text_instances = page.search_for(key)
-                        for inst in text_instances:
-                            rect = pymupdf.Rect(inst)
-                            rect.y0 -= 10
-                            rect.y1 += 10
-                            rect.x1 += 300
-                            page.add_redact_annot(rect, value, fontsize=12)
-                    page.apply_redactions()             
-                merged_files.insert_pdf(pdf)
-            pdf_bytes = io.BytesIO()
-            merged_files.save(pdf_bytes)
-            view_large_pdf(pdf_bytes.getvalue(), f'{column.split('.')[0]} - {df[column][0]} Report.pdf')
-            pdf_bytes.seek(0)
-        sub_cols = st.columns(2)
-        with sub_cols[0]:
-            st_copy_to_clipboard('Weekly Report\n'+'\n'.join(text).replace('###### ', '').replace('#### ', '').replace('**', ''), before_copy_label='Copy Raw Text to Clipboard', after_copy_label='Copied!')
-        with sub_cols[1]:
-            st_copy_to_clipboard('# Weekly Report\n'+'\n'.join(text).replace('### ', ' ').replace('###### ', '## '), before_copy_label='Copy With Styling to Clipboard', after_copy_label='Copied!')
-    with cols[1]:
-        training_program_files = get_training_program_names()
-        df = pd.read_csv(get_data(training_program_files[-1]))
-        st.markdown('### Your Upcoming Lessons', help='View your upcoming lessons based on the training program')
-        user_lessons = {}
-        for date in [(datetime.datetime.strptime(df['Week 1'][0], '%d/%m/%Y') + datetime.timedelta(weeks=i)).strftime('%d/%m/%Y') for i in range(len(df.columns) - 2)]:
-            user_lessons[date] = []
-        for column in df.columns[2:]:
-            if datetime.datetime.strptime(df[column][0], '%d/%m/%Y').date() >= datetime.datetime.now().date():
-                num = 2
-                for year in df['Year Group'].unique():
-                    if isinstance(year, str):
-                        for i in range(len(df['Period'].unique())-1):
-                            if isinstance(df[column][num], str) or isinstance(df[column][num + 1], str) or isinstance(df[column][num + 2], str):
-                                if df[column][num+2] == st.session_state.SUPABASE_CONNECTION.user['name']:
-                                    user_lessons[df[column][0]].append(f'- **Period {i + 1}:** {df[column][num]} - {df[column][num + 1]} with {year}')
-                            num += 3
-        key_counter = 0
-        for week, lessons in user_lessons.items():
-            if lessons:
-                st.write(f'#### {week}')
-                for lesson in lessons:
-                    key_counter += 1
-                    if lesson.startswith('-') and not lesson.split('**')[2].split('-')[0].strip().startswith('Other') and not lesson.split('**')[2].split('-')[0].strip().startswith('Not Specified'):
-                        if st.button(lesson.lstrip('-'), type='tertiary', help='View Lesson Plan/Guide', key=str(key_counter)+'_upcoming'):
-                            file = next((f for f in st.session_state.files if lesson.split('**')[2].split('-')[0].strip().startswith(f['path'].removesuffix('.pdf').removeprefix('Year ').removeprefix('1').removeprefix('2').removeprefix('3').removeprefix('4').split('-')[0].strip())), None)
-                            if file is None:
-                                file = next((f for f in st.session_state.SUPABASE_CONNECTION.syllabus if lesson.split('**')[2].split('-')[0].strip() == (f.removeprefix('Year ').removeprefix('1').removeprefix('2').removeprefix('3').removeprefix('4').split('-')[0].strip())), None)
+            lesson_index = st.session_state.SUPABASE_CONNECTION.lesson_index
+            for index, text_ in enumerate(text):
+                if index in lessons and lessons[index].is_lesson:
+                    if st.button(text_.lstrip('-'), type='tertiary', help='View Lesson Plan/Guide', key=str(index)):
+                        file = lesson_index.resolve(lessons[index].lesson_code)
+                        if file is None:
+                            st.warning('No lesson plan or guide found for this lesson', icon=':material/error:')
+                        else:
                             view_large_pdf(get_data(file), file)
-                    else:
-                        st.write(lesson.lstrip('-'))
-    with cols[2]:
-        '### Quick Links'
-        st.page_link('sub_pages/resources/lesson_plans.py', label='Lesson Plans', icon=':material/book:', help='View and download lesson plans')
-        st.page_link('sub_pages/resources/documents.py', label='Documents', icon=':material/quick_reference_all:', help='View and download documents')
-        st.page_link('sub_pages/tools/training_program.py', label='Training Program', icon=':material/table:', help='View the training program')
+                else:
+                    st.write(text_.lstrip('-'))
+            runner = get_job_runner()
+            pack_key = f'weekly_pack_{training_program_files[-1]["path"]}_{week.column}'
+            if st.button('View Weekly Documents', use_container_width=True, help='Click to view all the lesson plans or guides for this week'):
+                files = []
+                for period in lessons.values():
+                    if period.is_lesson:
+                        file = lesson_index.resolve(period.lesson_code)
+                        if isinstance(file, dict) and not file['signedURL']:
+                            # Gone from storage since the listing was read, so it is left out of the pack and the listing
+                            st.session_state.SUPABASE_CONNECTION.forget(file)
+                            st.warning(f'"*{file["path"].removesuffix(".pdf")}*" is no longer in storage and was left out', icon=':material/warning:')
+                        elif isinstance(file, dict):
+                            files.append({'url': file['signedURL'], 'source': f'{file["bucket"]}/{file["path"]}', 'version': file.get('version'), 'instructor': period.instructor or 'Not Specified'})
+                        elif file is not None:
+                            url = st.session_state.SUPABASE_CONNECTION.syllabus[file]['url']
+                            files.append({'url': url, 'source': url, 'instructor': period.instructor or 'Not Specified'})
+                renderer = get_lesson_plan_renderer()
+                pack = renderer.cached_weekly_pack(files, week.date_text)
+                if pack is not None:
+                    view_large_pdf(pack, f'{week.label} - {week.date_text} Report.pdf')
+                else:
+                    # Joins a pack that is already being built, otherwise starts a new one
+                    runner.submit(pack_key, 'Merging weekly documents', build_weekly_pack, renderer, files, week.date_text)
+                    st.session_state.open_weekly_pack = pack_key
+            job = runner.get(pack_key)
+            if job is not None and st.session_state.get('open_weekly_pack') == pack_key:
+                if not job.done:
+                    job_status(pack_key)
+                elif job.status == 'failed':
+                    st.session_state.pop('open_weekly_pack')
+                    st.error(f'Could not create the weekly documents: {job.error}', icon=':material/error:')
+                else:
+                    st.session_state.pop('open_weekly_pack')
+                    pack = get_lesson_plan_renderer().outputs.get(job.result)
+                    if pack is not None:
+                        view_large_pdf(pack, f'{week.label} - {week.date_text} Report.pdf')
+            sub_cols = st.columns(2)
+            with sub_cols[0]:
+                st_copy_to_clipboard('Weekly Report\n'+'\n'.join(text).replace('###### ', '').replace('#### ', '').replace('**', ''), before_copy_label='Copy Raw Text to Clipboard', after_copy_label='Copied!')
+            with sub_cols[1]:
+                st_copy_to_clipboard('# Weekly Report\n'+'\n'.join(text).replace('### ', ' ').replace('###### ', '## '), before_copy_label='Copy With Styling to Clipboard', after_copy_label='Copied!')
+        with cols[1]:
+            st.markdown('### Your Upcoming Lessons', help='View your upcoming lessons based on the training program')
+            user_lessons = {}
+            for lesson_week, period in program.lessons_for(st.session_state.SUPABASE_CONNECTION.user['name'], datetime.date.today()):
+                user_lessons.setdefault(lesson_week.date_text, []).append((period, f'- **Period {period.number}:** {period.code or "Not Specified"} - {period.title or "Not Specified"} with {period.year_group}'))
+            key_counter = 0
+            for week, lessons in user_lessons.items():
+                if lessons:
+                    st.write(f'#### {week}')
+                    for period, lesson in lessons:
+                        key_counter += 1
+                        if period.is_lesson:
+                            if st.button(lesson.lstrip('-'), type='tertiary', help='View Lesson Plan/Guide', key=str(key_counter)+'_upcoming'):
+                                file = lesson_index.resolve(period.lesson_code)
+                                if file is None:
+                                    st.warning('No lesson plan or guide found for this lesson', icon=':material/error:')
+                                else:
+                                    view_large_pdf(get_data(file), file)
+                        else:
+                            st.write(lesson.lstrip('-'))
     st.warning('Some pages are still in development')
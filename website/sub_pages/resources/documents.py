@@ -1,54 +1,66 @@
 import streamlit as st
-import json
 import requests
-import io
 from handlers.data.NZCF170CLoader import NZCF170CLoader
+from handlers.data.JobRunner import get_job_runner, job_status
+from handlers.data.BlobCache import get_blob_cache
+from handlers.data.PdfPreview import preview_pdf
+from handlers.data.SearchIndex import get_search_index, refresh_search_index
 
-if 'manuals' not in st.session_state:
-    st.session_state.manuals_path = st.session_state.BASE_PATH + '/resources/configurations/manuals.json'
-    with open(st.session_state.manuals_path, 'r') as file:
-        st.session_state.manuals = json.load(file)
-    st.session_state.manuals = dict(sorted(st.session_state.manuals.items()))
+st.session_state.manuals = st.session_state.SUPABASE_CONNECTION.manuals
 if 'manual_count' not in st.session_state:
     st.session_state.manual_count = 0
 if 'syllabus_count' not in st.session_state:
     st.session_state.syllabus_count = 0
 
-@st.cache_data(ttl=3600)
 def get_data(file):
     try:
-        response = requests.get(st.session_state.SUPABASE_CONNECTION.syllabus[file]['url'])
-        if response.status_code == 200:
-            return io.BytesIO(response.content).getvalue()
-    except KeyError:
-        response = requests.get(st.session_state.manuals[file])
-        if response.status_code == 200:
-            return io.BytesIO(response.content).getvalue()
+        if file in st.session_state.SUPABASE_CONNECTION.syllabus:
+            return st.session_state.SUPABASE_CONNECTION.guide_path(file)
+        return get_blob_cache().path(st.session_state.manuals[file], st.session_state.manuals[file])
+    except requests.HTTPError:
+        return None
 
 
 try:
     @st.dialog('File Preview', width="large")
-    def view_large_pdf(file_name):
+    def view_large_pdf(file_name, page=0):
         file_data = get_data(file_name)
         st.write(f'Viewing: *{file_name.removesuffix('.pdf')}*')
-        st.download_button('Download PDF', data=file_data, file_name=file_name+'.pdf', mime='application/octet-stream', icon=':material/download:')
-        st.pdf(file_data, height=750)
+        if file_data is None:
+            st.error('Could not download this document', icon=':material/error:')
+        else:
+            preview_pdf(file_data, file_name+'.pdf', page)
 except AttributeError:
     pass
 
 
+def sync_syllabus(job, loader, shared):
+    changes = loader.fetch_all_lessons(progress=job.update)
+    shared.invalidate('syllabus')
+    return changes
+
+
 def update_search(search):
     if search == 'manuals': st.session_state.manual_count = 0
     if search == 'syllabus': st.session_state.syllabus_count = 0
 
 
+refresh_search_index(st.session_state.SUPABASE_CONNECTION)
+query = st.text_input('Search Inside Documents', placeholder='Search the text of manuals and instructor guides...', help='Find the pages of manuals and instructor guides that mention a topic')
+if query:
+    hits = get_search_index().search(query, kinds=['manual', 'guide'], limit=10)
+    st.caption(f'*Showing the top {len(hits)} matching pages*' if hits else '*No matching pages*')
+    for index, hit in enumerate(hits):
+        if st.button(f'{hit["title"]} - Page {hit["page"] + 1}', type='tertiary', icon=':material/search:', help='View this page', key=f'hit_{index}'):
+            view_large_pdf(hit['title'], hit['page'])
+        st.caption(hit['snippet'])
 st.toggle('Display as links', key='display_as_links', value=False, help='Toggle between displaying documents as links or buttons')
 cols = st.columns(3, border=True)
 
 with cols[0]:
     st.write('### Manuals')
     search = st.text_input('Search', placeholder='Search for Manuals...', help='Search for a specific manual', on_change=lambda x='manuals': update_search(x))
-    manuals = [m for m in st.session_state.manuals if search.lower() in m.lower()]
+    manuals = st.session_state.SUPABASE_CONNECTION.title_index('manuals').search(search)
     st.caption(f'*Showing {len(manuals[st.session_state.manual_count:st.session_state.manual_count + 10])}/{len(st.session_state.manuals)} manuals*')
     for manual in manuals[st.session_state.manual_count:st.session_state.manual_count + 10]:
         if st.session_state.display_as_links:
@@ -71,7 +83,7 @@ with cols[0]:
 with cols[1]:
     st.write('### Syllabus')
     search = st.text_input('Search', placeholder='Search for Instructor Guides...', help='Search for a specific Lesson', on_change=lambda x='syllabus': update_search(x))
-    syllabus = [s for s in st.session_state.SUPABASE_CONNECTION.syllabus if search.lower() in s.lower()]
+    syllabus = st.session_state.SUPABASE_CONNECTION.title_index('syllabus').search(search)
     st.caption(f'*Showing {len(syllabus[st.session_state.syllabus_count:st.session_state.syllabus_count + 10])}/{len(st.session_state.SUPABASE_CONNECTION.syllabus)} lessons*')
     for syllabus_item in syllabus[st.session_state.syllabus_count:st.session_state.syllabus_count + 10]:
         if st.session_state.display_as_links:
@@ -93,11 +105,29 @@ with cols[1]:
 
 with cols[2]:
     if 'Admin' in st.session_state.SUPABASE_CONNECTION.user['permissions']:
+        runner = get_job_runner()
         if st.button('Update Syllabus', icon=':material/update:', use_container_width=True, help='Update the syllabus from CadetNet'):
-            loader = NZCF170CLoader(st.session_state.BASE_PATH)
-            with st.spinner('Fetching lessons from CadetNet...'):
-                data = loader.fetch_all_lessons()
-            st.success('Lessons updated successfully!')
+            runner.submit('syllabus_sync', 'Fetching lessons from CadetNet', sync_syllabus, NZCF170CLoader(st.session_state.BASE_PATH), st.session_state.SUPABASE_CONNECTION.shared)
+        job = runner.get('syllabus_sync')
+        if job is not None:
+            if not job.done:
+                job_status(job.key)
+            else:
+                if job.status == 'failed':
+                    st.error(f'Syllabus update stopped: {job.error}. Run the update again to resume where it stopped.', icon=':material/error:')
+                else:
+                    changes = job.result
+                    # Re-index the guides once per finished sync
+                    if st.session_state.get('indexed_sync') is not job:
+                        st.session_state.indexed_sync = job
+                        refresh_search_index(st.session_state.SUPABASE_CONNECTION, force=True)
+                    st.success(f'Syllabus updated: {len(changes["added"])} added, {len(changes["changed"])} changed, {len(changes["removed"])} removed', icon=':material/check:')
+                    if any(changes.values()):
+                        with st.expander('View Changes'):
+                            st.markdown('\n'.join(f'- **{change.title()}:** {lesson}' for change, lessons in changes.items() for lesson in lessons))
+                if st.button('Dismiss', use_container_width=True, help='Clear the result of the last update'):
+                    runner.clear(job.key)
+                    st.rerun()
     else:
         st.warning('Admin required to view this section')
 '---'
@@ -1,19 +1,21 @@
 import streamlit as st
-import pymupdf
-import io
 import requests
 import urllib
 
+from handlers.data.LessonPlanRenderer import get_lesson_plan_renderer
+from handlers.data.BlobCache import get_blob_cache
+from handlers.data.PdfPreview import preview_pdf
+from handlers.data.SearchIndex import get_search_index, refresh_search_index
+
 cols = st.columns([3, 5, 1], gap='large')
 
-if 'files' not in st.session_state:
-    st.session_state.files = st.session_state.SUPABASE_CONNECTION.supabase.create_signed_urls('lesson_plans', [file['name'] for file in st.session_state.SUPABASE_CONNECTION.supabase.list_objects('lesson_plans', ttl='0s')], expires_in=3600)
-if 'pdf' not in st.session_state:
-    st.session_state['pdf'] = None
+st.session_state.files = st.session_state.SUPABASE_CONNECTION.lesson_plans
+# Only the render cache key of the filled lesson plan is kept per session
+if 'filled_pdf' not in st.session_state:
+    st.session_state.filled_pdf = None
 if 'file_count' not in st.session_state:
     st.session_state.file_count = 0
 
-st.session_state.files.sort(key=lambda x: (not x['path'].endswith('Template.pdf'), x['path']))
 icons = {'Default': ':material/docs:',
          'Template': ':material/docs:',
          'AVS': ':material/flight:',
@@ -33,28 +35,21 @@ icons = {'Default': ':material/docs:',
          'SEA': ':material/sailing:',
          'Other': ':material/question_mark:'}
 
-@st.cache_data(ttl=3600)
 def get_data(file):
     try:
-        response = requests.get(file['signedURL'])
-        if response.status_code == 200:
-            return io.BytesIO(response.content).getvalue()
-        st.session_state.pop('files')
-        st.rerun()
-    except TypeError:
-        response = requests.get(file)
-        if response.status_code == 200:
-            return io.BytesIO(response.content).getvalue()
-        st.session_state.pop('files')
+        if isinstance(file, str):
+            return get_blob_cache().get(file, file)
+        return st.session_state.SUPABASE_CONNECTION.get_file(file)
+    except requests.HTTPError:
+        st.session_state.SUPABASE_CONNECTION.invalidate('lesson_plans')
         st.rerun()
 
 
 try:
     @st.dialog('File Preview', width="large")
-    def view_large_pdf(file_data, file_name):
+    def view_large_pdf(file_data, file_name, page=0):
         st.write(f'Viewing: *{file_name.removesuffix('.pdf')}*')
-        st.download_button('Download PDF', data=file_data, file_name=file_name, mime='application/octet-stream', icon=':material/download:')
-        st.pdf(file_data, height=750)
+        preview_pdf(file_data, file_name, page)
 except AttributeError:
     pass
 
@@ -64,6 +59,14 @@ def update_search():
 
 
 
+def record_change(change):
+    try:
+        st.session_state.SUPABASE_CONNECTION.manifest.record_or_rebuild('lesson_plans', change)
+    except Exception:
+        st.error('The change was saved, but the list of lesson plans could not be updated. Use **Rebuild File List** to update it.', icon=':material/error:')
+        st.stop()
+
+
 @st.dialog('Confirm Deletion', width='small')
 def confirmation(file):
     st.error(f'**Are you sure you want to delete "*{file}*"?**')
@@ -75,7 +78,9 @@ def confirmation(file):
     with cols[1]:
         if st.button('**:red[Delete]**', use_container_width=True, help='Delete the lesson plan'):
             st.session_state.SUPABASE_CONNECTION.supabase.remove('lesson_plans', [f'{file}.pdf'])
-            st.session_state.pop('files')
+            record_change(lambda manifest: manifest.record_delete('lesson_plans', f'{file}.pdf'))
+            st.session_state.SUPABASE_CONNECTION.invalidate('lesson_plans')
+            refresh_search_index(st.session_state.SUPABASE_CONNECTION, force=True)
             st.rerun()
 
 
@@ -83,14 +88,16 @@ with cols[0]:
     st.write('#### Lesson Plan Viewer')
     st.toggle('Display as links', key='display_as_links', value=False, help='Toggle between displaying lesson plans as links or buttons')
     search = st.text_input('Search', key='search', placeholder='Search for Lesson Plans...', help='Search for a specific lesson plan', on_change=update_search)
-    files = [f for f in st.session_state.files if search.lower() in f['path'].lower().removesuffix('.pdf')]
+    by_title = {f['path'].removesuffix('.pdf'): f for f in st.session_state.files}
+    files = [by_title[title] for title in st.session_state.SUPABASE_CONNECTION.title_index('lesson_plans').search(search)]
     st.caption(f'*Showing {len(files[st.session_state.file_count:st.session_state.file_count + 10])}/{len(st.session_state.files)} lesson plans*')
     for file in files[st.session_state.file_count:st.session_state.file_count + 10]:
         try:
             icon = icons[file['path'].split(' - ')[0].split(' ')[-2]]
         except (KeyError, IndexError):
             icon = icons['Default']
-        if st.session_state.display_as_links:
+        # A file with no signed URL has gone from storage, its button removes it from the list when clicked
+        if st.session_state.display_as_links and file['signedURL']:
             st.write(f'{icon} [{file['path'].removesuffix('.pdf')}]({urllib.parse.quote(file['signedURL'], safe=":/?=&")})')
         else:
             if st.button(file['path'].removesuffix('.pdf'), icon=icon, type='tertiary', help='View this lesson plan'):
@@ -106,6 +113,16 @@ with cols[0]:
             if st.button('Next', icon=':material/arrow_forward:', use_container_width=True, help='View the next 10 lesson plans'):
                 st.session_state.file_count += 10
                 st.rerun()
+    refresh_search_index(st.session_state.SUPABASE_CONNECTION)
+    query = st.text_input('Search Contents', placeholder='Search inside Lesson Plans...', help='Find the lesson plans that cover a topic')
+    if query:
+        paths = {f'lesson_plan:{f["path"]}': f for f in st.session_state.files}
+        hits = [hit for hit in get_search_index().search(query, kinds=['lesson_plan'], limit=10) if hit['id'] in paths]
+        st.caption(f'*Showing the top {len(hits)} matching pages*' if hits else '*No matching pages*')
+        for index, hit in enumerate(hits):
+            if st.button(f'{hit["title"]} - Page {hit["page"] + 1}', type='tertiary', icon=':material/search:', help='View this page', key=f'hit_{index}'):
+                view_large_pdf(get_data(paths[hit['id']]), paths[hit['id']]['path'], hit['page'])
+            st.caption(hit['snippet'])
 
 with cols[1]:
     tabs = st.tabs(['Autofill Lesson Plans', 'Lesson Plan Manager'])
@@ -121,49 +138,46 @@ with cols[1]:
                     '[INSTRUCTOR]': instructor,
                     '[NAME]': instructor
                 }
-                st.session_state['pdf'] = pymupdf.open(stream=get_data(st.session_state.files[[f['path'] for f in st.session_state.files].index(selected_file + '.pdf')]))
-                for page in st.session_state['pdf']:
-                    for key, value in replacements.items():
-                        text_instances = page.search_for(key)
-                        for inst in text_instances:
-                            rect = pymupdf.Rect(inst)
-                            rect.y0 -= 10
-                            rect.y1 += 10
-                            rect.x1 += 300
-                            page.add_redact_annot(rect, value, fontsize=12)
-                    page.apply_redactions()                
-        try:
-            pdf_bytes = io.BytesIO()
-            st.session_state['pdf'].save(pdf_bytes)
+                template = get_data(st.session_state.files[[f['path'] for f in st.session_state.files].index(selected_file + '.pdf')])
+                st.session_state.filled_pdf = get_lesson_plan_renderer().fill_key(template, replacements)
+        pdf_bytes = get_lesson_plan_renderer().outputs.get(st.session_state.filled_pdf) if st.session_state.filled_pdf else None
+        if pdf_bytes is not None:
             st.success(f'Lesson Plan *"{selected_file}"* Created!', icon=':material/check:')
             sub_cols = st.columns(2)
             with sub_cols[0]:
-                st.download_button('Download as PDF', data=pdf_bytes.getvalue(), file_name=f'{selected_file} - {date.strftime("%d-%m-%Y")}.pdf', mime='application/octet-stream', icon=':material/download:', use_container_width=True, help='Download')
+                st.download_button('Download as PDF', data=pdf_bytes, file_name=f'{selected_file} - {date.strftime("%d-%m-%Y")}.pdf', mime='application/octet-stream', icon=':material/download:', use_container_width=True, help='Download')
             with sub_cols[1]:
                 if st.button('Preview', icon=':material/visibility:', use_container_width=True, help='Preview the lesson plan'):
-                    view_large_pdf(pdf_bytes.getvalue(), selected_file+'.pdf')
-            pdf_bytes.seek(0)
-        except AttributeError:
-            pass
+                    view_large_pdf(pdf_bytes, selected_file+'.pdf')
     with tabs[1]:
-        if 'manage_lesson_plans' in st.session_state.SUPABASE_CONNECTION.user['permissions_expanded']:
+        if st.session_state.SUPABASE_CONNECTION.has_permission('manage_lesson_plans'):
+            lesson_search = st.text_input('Find Lesson', placeholder='Search the syllabus, e.g. drl12...', help='Narrow down the lessons to choose from below')
             with st.form(key='submit_lesson_plan', enter_to_submit=False):
                 uploaded_pdf = st.file_uploader('Upload a Lesson Plan', type='pdf', help='Select a lesson plan to upload')
-                pdf_name = st.selectbox('Lesson Plan For:', st.session_state.SUPABASE_CONNECTION.syllabus, help='Select a name for the lesson plan', accept_new_options=True)
+                pdf_name = st.selectbox('Lesson Plan For:', st.session_state.SUPABASE_CONNECTION.title_index('syllabus').search(lesson_search), help='Select a name for the lesson plan', accept_new_options=True)
                 if st.form_submit_button('Upload Lesson Plan', help='Upload the lesson plan to the database'):
                     if not uploaded_pdf:
                         st.error('Please upload a PDF file', icon=':material/error:')
                     else:
                         try:
                             st.session_state.SUPABASE_CONNECTION.supabase.upload('lesson_plans', source='local', file=uploaded_pdf, destination_path=f'/{pdf_name}.pdf', overwrite='true')
-                            st.session_state.pop('files')
-                            st.rerun()
                         except Exception as e:
                             st.error('File already exists, try another name', icon=':material/error:')
+                        else:
+                            record_change(lambda manifest: manifest.record_upload('lesson_plans', f'{pdf_name}.pdf', uploaded_pdf.getvalue()))
+                            # Locate the placeholders now so the first autofill skips the text search
+                            get_lesson_plan_renderer().placements(uploaded_pdf.getvalue())
+                            st.session_state.SUPABASE_CONNECTION.invalidate('lesson_plans')
+                            refresh_search_index(st.session_state.SUPABASE_CONNECTION, force=True)
+                            st.rerun()
             with st.form(key='remove_lesson_plan'):
                 selected_file = st.selectbox('Select a Lesson Plan to Delete', [f['path'].removesuffix('.pdf') for f in st.session_state.files], help='Select a lesson plan to remove')
                 if st.form_submit_button('**:red[Delete Lesson Plan]**', help='Delete the selected lesson plan'):
                     confirmation(selected_file)
+            if st.button('Rebuild File List', icon=':material/sync:', help='Re-read the list of lesson plans from storage, e.g. after files were changed outside the portal'):
+                st.session_state.SUPABASE_CONNECTION.manifest.rebuild('lesson_plans')
+                st.session_state.SUPABASE_CONNECTION.invalidate('lesson_plans')
+                st.rerun()
         else:
             st.warning('You do not have permission to access this tab')
 
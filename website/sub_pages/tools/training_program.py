@@ -1,26 +1,33 @@
 import streamlit as st
 import requests
-import io
 import pandas as pd
 import datetime
-    
-@st.cache_data(ttl=3600)
+
+from handlers.data.TrainingProgram import TrainingProgram, program_label, program_path, cell_changes, diff_records
+from handlers.data.ProgramHistory import ProgramHistory
+
+
 def get_data(file):
-    response = requests.get(file['signedURL'])
-    if response.status_code == 200:
-        return io.BytesIO(response.content)
-    st.rerun()
+    try:
+        return st.session_state.SUPABASE_CONNECTION.file_path(file)
+    except requests.HTTPError:
+        st.session_state.SUPABASE_CONNECTION.invalidate('training_programs')
+        st.rerun()
+
+
+def record_change(change):
+    try:
+        st.session_state.SUPABASE_CONNECTION.manifest.record_or_rebuild('training_programs', change)
+    except Exception:
+        saved_with_stale_list()
 
 
-@st.cache_data(ttl=3600)
-def extend_rows(df, var_string, var, count):
-    if len(var) > 0:
-        selected_indices = df.index[df[var_string].isin(var)].tolist()
-        additional_indices = []
-        for idx in selected_indices:
-            additional_indices.extend(range(idx, min(idx + count, len(df))))
-        return df.loc[additional_indices]
-    return df
+def saved_with_stale_list(message='The change was saved, but the list of training programs could not be updated. Use **Rebuild File List** to update it.'):
+    st.session_state.pop('program_edit', None)
+    st.session_state.pop('program_editor', None)
+    st.session_state.SUPABASE_CONNECTION.invalidate('training_programs')
+    st.error(message, icon=':material/error:')
+    st.stop()
 
 
 @st.dialog('Confirm Deletion', width='small')
@@ -33,19 +40,15 @@ def confirmation(file):
             st.rerun()
     with cols[1]:
         if st.button('**:red[Delete]**', use_container_width=True, help='Delete the training program'):
-            file = file.replace(': ', '_').replace('Term ', '')
-            st.session_state.SUPABASE_CONNECTION.supabase.remove('training_programs', [f'{file}.pdf'])
+            st.session_state.SUPABASE_CONNECTION.supabase.remove('training_programs', [program_path(file)])
+            record_change(lambda manifest: manifest.record_delete('training_programs', program_path(file)))
+            if st.session_state.get('program_edit', {}).get('path') == program_path(file):
+                st.session_state.pop('program_edit')
+                st.session_state.pop('program_editor', None)
+            st.session_state.SUPABASE_CONNECTION.invalidate('training_programs')
             st.rerun()
 
 
-def color_column(val):
-    return f'background-color: {st.get_option('theme.borderColor')}'
-
-
-def color_users(val):
-    if users.__contains__(val):
-        return 'background-color: #ff4500; color: black; font-weight: bold;'
-
 Colors = {
          'AVS': '#7adbff',
          'DRL': '#ffd7ff',
@@ -65,31 +68,38 @@ Colors = {
          'Other': "#949494"
          }
 
-def color_lessons(val):
-    try:
-        if val.split()[0] in Colors:
-            return f'background-color: {Colors[val.split()[0]]}; color: black;'
-    except IndexError:
-        pass
-    
-
-def get_training_program_names():        
-    training_program_files = {}
-    for file in st.session_state.SUPABASE_CONNECTION.training_programs:
-        if file['path'] == 'active_training_programs.csv':
-            active_training_programs = pd.read_csv(get_data(file))
-    for file in st.session_state.SUPABASE_CONNECTION.training_programs:
-        if file['path'] != 'active_training_programs.csv':
-            file_name = file['path']
-            file_name = file_name.removesuffix('.csv')
-            split_file_name = file_name.split('_')
-            year = split_file_name[0]
-            term = split_file_name[1]
-            file_renamed = f'{year}: Term {term}'
-            for name, is_active in zip(active_training_programs['name'], active_training_programs['active']):
-                if name == file_renamed and is_active == True:
-                    training_program_files[file_renamed] = file
-    return training_program_files
+@st.cache_resource(max_entries=64, ttl=3600)
+def get_program_view(_program, path, version, years, periods, weeks, users, column):
+    # Display frame and cell styles for one set of filters, shared by every rerun and session that asks for it
+    df = _program.display_frame(years, periods, weeks)
+    return df, _program.display_styles(df, users, column, Colors, st.get_option('theme.borderColor'))
+
+
+def active_programs_editor():
+    # Toggles are collected in a form and written together, only the flags that changed are sent so toggles from someone else are kept
+    active_TPs_df = pd.DataFrame(
+        [{'name': program_label(file['path']), 'active': file['active']} for file in st.session_state.SUPABASE_CONNECTION.training_programs],
+        columns=['name', 'active']
+    )
+    with st.form(key='active_programs', border=False):
+        edited_data = st.data_editor(active_TPs_df,
+                                     column_config={
+                                         'name': st.column_config.TextColumn('Name', width=125, disabled=True),
+                                         'active': st.column_config.CheckboxColumn('Active', width=100)
+                                     },
+                                     hide_index=True,
+                                     use_container_width=False,
+                                     height=384)
+        if st.form_submit_button('Save Active Programs', help='Save the active training programs'):
+            changes = {program_path(name): bool(active) for name, active, was in zip(edited_data['name'], edited_data['active'], active_TPs_df['active']) if bool(active) != bool(was)}
+            if changes:
+                record_change(lambda manifest: manifest.set_active('training_programs', changes))
+                st.session_state.SUPABASE_CONNECTION.invalidate('training_programs')
+                st.rerun()
+
+
+def get_training_program_names():
+    return {program_label(file['path']): file for file in st.session_state.SUPABASE_CONNECTION.training_programs if file['active']}
 
 
 training_program_files = get_training_program_names()
@@ -98,140 +108,103 @@ with tabs[0]:
     training_program = st.selectbox('Select Training Program', options=training_program_files, index=len(training_program_files)-1, help='Select the training program to display.')
 
     try:
-        df = pd.read_csv(get_data(training_program_files[training_program]))
+        program = st.session_state.SUPABASE_CONNECTION.get_training_program(training_program_files[training_program])
 
         cols = st.columns(4)
         with cols[0]:
-            years = st.multiselect('Select Year Groups to Display', options=[year for year in df['Year Group'].unique() if isinstance(year, str)], help='Select the year groups to display.')
+            years = st.multiselect('Select Year Groups to Display', options=program.year_groups, help='Select the year groups to display.')
         with cols[1]:
-            periods = st.multiselect('Select Periods to Display', options=[period for period in df['Period'].unique() if isinstance(period, str)], help='Select the periods to display.')
+            periods = st.multiselect('Select Periods to Display', options=program.period_names, help='Select the periods to display.')
         with cols[2]:
-            weeks = st.multiselect('Select Weeks to Display', options=df.columns[2:], help='Select the Weeks to display.')
+            weeks = st.multiselect('Select Weeks to Display', options=program.frame.columns[2:], help='Select the Weeks to display.')
         with cols[3]:
-            users = st.multiselect('Select Users to Display', options=[user['name'] for user in st.session_state.SUPABASE_CONNECTION.users.data], default=st.session_state.SUPABASE_CONNECTION.user['name'], help='Select the users to display.')
-
-        next_date = None
-        for date in [(datetime.datetime.strptime(df['Week 1'][0], '%d/%m/%Y') + datetime.timedelta(weeks=i)).strftime('%d/%m/%Y') for i in range(len(df.columns) - 2)]:
-            if datetime.datetime.strptime(date, '%d/%m/%Y') >= datetime.datetime.strptime(datetime.datetime.now().strftime('%d/%m/%Y'), '%d/%m/%Y'):
-                next_date = date
-                break
-        for column in df.columns:
-            if df[column][0] == next_date:
-                break
-
-        df = extend_rows(df, 'Year Group', years, 3).reset_index(drop=True)
-        df = extend_rows(df, 'Period', periods, 3).reset_index(drop=True)
-
-        if len(weeks) > 0:
-            weeks.insert(0, 'Period')
-            weeks.insert(0, 'Year Group')
-            df = df[weeks]
-
-        rows_to_delete = []
+            users = st.multiselect('Select Users to Display', options=st.session_state.SUPABASE_CONNECTION.users.names, default=st.session_state.SUPABASE_CONNECTION.user['name'], help='Select the users to display.')
 
-        for start in range(2, len(df), 3):
-            if start + 1 < len(df):
-                for col in df.columns:
-                    df.loc[start, col] = f'{df.loc[start, col]} {df.loc[start + 1, col]}'.removesuffix(' nan')
-                    if df.loc[start, col] == 'nan':
-                        df.loc[start, col] = ''
-                rows_to_delete.append(start + 1)
+        column = program.next_week(datetime.date.today()).column
 
-        df = df.drop(index=rows_to_delete).reset_index(drop=True)
-
-
-        df.fillna(' ', inplace=True)
-
-        year_group_indices = {year: df.index[df['Year Group'] == year].tolist() for year in df['Year Group'].unique()}
-        year_group_indices.pop(' ')
-        for indices in year_group_indices:
-            for idx in year_group_indices[indices][1:]:
-                df.loc[idx, 'Year Group'] = ''
+        program_file = training_program_files[training_program]
+        df, styles = get_program_view(program, program_file['path'], program_file.get('version'), tuple(years), tuple(periods), tuple(weeks), tuple(sorted(users)), column)
         column_config = {}
         for week in df.columns:
             column_config[week] = st.column_config.TextColumn(week, width=200)
         column_config['Year Group'] = st.column_config.TextColumn('Year Group', width=100, pinned=True)
         column_config['Period'] = st.column_config.TextColumn('Period', width=100, pinned=True)
-        try:
-            st.dataframe(df.style.map(color_column, subset=[column]).map(color_users).map(color_lessons),
-                        hide_index=True,
-                        column_config=column_config,
-                        height=705)
-        except KeyError:
-            st.dataframe(df,
-                        hide_index=True,
-                        height=705)
+        st.dataframe(df.style.apply(lambda _: styles, axis=None),
+                    hide_index=True,
+                    column_config=column_config,
+                    height=705)
     except KeyError:
         st.error('No active training programs available')
 
 with tabs[1]:
-    if 'manage_training_program' in st.session_state.SUPABASE_CONNECTION.user['permissions_expanded']:
+    if st.session_state.SUPABASE_CONNECTION.has_permission('manage_training_program'):
         columns = st.columns([2, 6, 1], gap='large')
         with columns[0]:
-            for file in st.session_state.SUPABASE_CONNECTION.training_programs:
-                if file['path'] == 'active_training_programs.csv':
-                    active_TPs_df = pd.read_csv(get_data(file))
-                    break
             st.write('##### Active Training Programs')
-            edited_data = st.data_editor(active_TPs_df,
-                                         column_config={
-                                             'name': st.column_config.TextColumn('Name', width=125, disabled=True),
-                                             'active': st.column_config.CheckboxColumn('Active', width=100)
-                                         },
-                                         hide_index=True,
-                                         use_container_width=False,
-                                         height=384)
-            if (edited_data.to_dict(orient='records') != active_TPs_df.to_dict(orient='records')):
-                csv_bytes = io.BytesIO(edited_data.to_csv(index=False).encode('utf-8'))
-                csv_bytes.name = 'active_training_programs.csv'
-                csv_bytes.type = 'text/csv'
-                st.session_state.SUPABASE_CONNECTION.supabase.upload(bucket_id='training_programs',
-                                            source='local',
-                                            file=csv_bytes,
-                                            destination_path='/active_training_programs.csv',
-                                            overwrite='true')
-                st.rerun()
+            active_programs_editor()
         with columns[1]:
             st.write('##### Editor')
-            all_training_programs = {}
-            for file in st.session_state.SUPABASE_CONNECTION.training_programs:
-                if file['path'] != 'active_training_programs.csv':
-                    file_name = file['path']
-                    file_name = file_name.removesuffix('.csv')
-                    split_file_name = file_name.split('_')
-                    year = split_file_name[0]
-                    term = split_file_name[1]
-                    file_renamed = f'{year}: Term {term}'
-                    all_training_programs[file_renamed] = file
+            all_training_programs = {program_label(file['path']): file for file in st.session_state.SUPABASE_CONNECTION.training_programs}
             selected_file = st.selectbox('Select Training Program', options=all_training_programs, help='Select the training program to edit.')
             if selected_file:
-                df = pd.read_csv(get_data(all_training_programs[selected_file]))
+                # Edits are made against the copy that was open when editing started, so a save can tell what changed since
+                if st.session_state.get('program_edit', {}).get('path') != all_training_programs[selected_file]['path']:
+                    st.session_state.pop('program_editor', None)
+                    st.session_state.program_edit = {
+                        'path': all_training_programs[selected_file]['path'],
+                        'file': all_training_programs[selected_file],
+                        'frame': pd.read_csv(get_data(all_training_programs[selected_file]))
+                    }
+                df = st.session_state.program_edit['frame']
                 column_config = {}
                 for week in df.columns:
                     column_config[week] = st.column_config.TextColumn(week, width=200)
                 column_config['Year Group'] = st.column_config.TextColumn('Year Group', width=100, pinned=True)
                 column_config['Period'] = st.column_config.TextColumn('Period', width=100, pinned=True)
-                edited_data = st.data_editor(df,
+                st.data_editor(df,
+                                key='program_editor',
                                 column_config=column_config,
                                 hide_index=True,
                                 use_container_width=False,
                                 height=300)
+                changes = cell_changes(df, st.session_state.program_editor['edited_rows'])
+                if changes:
+                    st.caption(f'*{len(changes)} unsaved cell change{"s" if len(changes) != 1 else ""}*')
+                for row, column, theirs in st.session_state.pop('program_conflicts', []):
+                    st.warning(f'**Row {row + 1}, {column}** was changed by someone else while you were editing, their value "*{theirs}*" was kept', icon=':material/warning:')
                 sub_cols = st.columns([1, 1])
                 with sub_cols[0]:
-                    if st.button('**:green[Save Changes]**', help='Save changes to the training program', use_container_width=True):
-                        csv_bytes = io.BytesIO(edited_data.to_csv(index=False).encode('utf-8'))
-                        selected_file = selected_file.replace(': ', '_').replace('Term ', '')
-                        csv_bytes.name = f'{selected_file}.csv'
-                        csv_bytes.type = 'text/csv'
-                        st.session_state.SUPABASE_CONNECTION.supabase.upload(bucket_id='training_programs',
-                                                    source='local',
-                                                    file=csv_bytes,
-                                                    destination_path=f'/{csv_bytes.name}',
-                                                    overwrite='true')
-                        st.rerun()
+                    if st.button('**:green[Save Changes]**', help='Save changes to the training program', use_container_width=True, disabled=not changes):
+                        try:
+                            st.session_state.program_conflicts = st.session_state.SUPABASE_CONNECTION.save_training_program(st.session_state.program_edit['file'], df, changes)
+                        except ValueError as e:
+                            st.error(str(e), icon=':material/error:')
+                        except RuntimeError as e:
+                            saved_with_stale_list(str(e))
+                        else:
+                            st.session_state.pop('program_edit')
+                            st.session_state.pop('program_editor')
+                            st.rerun()
                 with sub_cols[1]:
                     if st.button('**:red[Remove Training Program]**', help='Remove the selected training program', use_container_width=True):
                         confirmation(selected_file)
+                snapshots = st.session_state.SUPABASE_CONNECTION.history.snapshots(all_training_programs[selected_file]['path'])
+                if snapshots:
+                    with st.expander('History', icon=':material/history:'):
+                        saved = {snapshot['object']: snapshot for snapshot in reversed(snapshots)}
+                        label = lambda name: datetime.datetime.fromtimestamp(saved[name]['saved']).strftime('%d/%m/%Y %H:%M:%S')
+                        since = st.selectbox('Changes Since', options=saved, index=list(saved).index(ProgramHistory.since(snapshots, 7 * 86400)['object']), format_func=label, help='Select an earlier version to compare with, defaults to the version from a week ago')
+                        records = st.session_state.SUPABASE_CONNECTION.get_snapshot(saved[since])
+                        history_changes = diff_records(records, st.session_state.SUPABASE_CONNECTION.get_training_program(all_training_programs[selected_file]).records())
+                        if history_changes.empty:
+                            st.info('No changes since this version')
+                        else:
+                            st.dataframe(history_changes, hide_index=True, column_config={'week': st.column_config.DateColumn('Week', format='DD/MM/YYYY')})
+                        st.download_button('Download This Version', data=lambda: TrainingProgram.from_records(records).frame.to_csv(index=False), file_name=f'{selected_file.replace(": ", "_")} ({label(since).replace("/", "-").replace(":", "")}).csv', mime='text/csv', icon=':material/download:')
+            if st.button('Rebuild File List', icon=':material/sync:', help='Re-read the list of training programs from storage, e.g. after files were changed outside the portal'):
+                st.session_state.SUPABASE_CONNECTION.manifest.rebuild('training_programs')
+                st.session_state.SUPABASE_CONNECTION.invalidate('training_programs')
+                st.rerun()
             
     else:
         st.warning('You do not have permission to access this tab')
\ No newline at end of file
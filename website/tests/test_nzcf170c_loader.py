@@ -0,0 +1,170 @@
+# NZCF170CLoader against a local stand-in for the CadetNet worker
+# - Run from website/: python -m pytest tests
+import json
+import pathlib
+import sys
+import threading
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+import requests
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+
+from handlers.data import NZCF170CLoader as loader_module
+from handlers.data.NZCF170CLoader import NZCF170CLoader
+
+# Three batches of one module each, then the end of the catalogue
+CATALOGUE = {
+    start: {'_count': 1, 'Year 1': {f'Module {start}': {'1.1': {'title': f'&#8211; Lesson {start}'}}}}
+    for start in (0, 15, 30)
+}
+
+
+class Worker:
+    def __init__(self) -> None:
+        self.requests = Counter()
+        self.failures = {}  # batch start -> failures left to send, -1 for always
+        self.failure_status = 503
+        self.catalogue = dict(CATALOGUE)
+
+    def batch(self, start: int) -> tuple:
+        self.requests[start] += 1
+        if self.failures.get(start):
+            self.failures[start] -= self.failures[start] > 0
+            return self.failure_status, {}
+        return 200, self.catalogue.get(start, {'_count': 0})
+
+
+@pytest.fixture
+def worker():
+    state = Worker()
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args) -> None:
+            pass
+
+        def do_GET(self) -> None:
+            status, body = state.batch(int(parse_qs(urlsplit(self.path).query)['start'][0]))
+            data = json.dumps(body).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    state.url = f'http://127.0.0.1:{server.server_port}/'
+    yield state
+    server.shutdown()
+
+
+@pytest.fixture
+def loader(worker, tmp_path):
+    loader = NZCF170CLoader(tmp_path, token='t', worker_url=worker.url)
+    loader.DELAY = 0
+    loader.BACKOFF = 0.01
+    return loader
+
+
+def test_sync_writes_every_module(loader):
+    changes = loader.fetch_all_lessons()
+
+    assert sorted(changes['added']) == [f'Year 1 Module {start} 1.1 - Lesson {start}' for start in (0, 15, 30)]
+    assert set(json.loads(loader.out_path.read_text())['Year 1']) == {'Module 0', 'Module 15', 'Module 30'}
+    assert not loader.checkpoint_path.exists()
+
+
+def test_failed_requests_are_retried(loader, worker):
+    worker.failures[15] = 2
+
+    changes = loader.fetch_all_lessons()
+
+    assert worker.requests[15] == 3
+    assert len(changes['added']) == 3
+
+
+def test_retries_give_up(loader, worker):
+    loader.MAX_RETRIES = 2
+    worker.failures[15] = -1
+
+    with pytest.raises(requests.HTTPError):
+        loader.fetch_all_lessons()
+    assert worker.requests[15] == 3
+
+
+def test_client_errors_are_not_retried(loader, worker):
+    worker.failures[15] = -1
+    worker.failure_status = 401
+
+    with pytest.raises(requests.HTTPError):
+        loader.fetch_all_lessons()
+    assert worker.requests[15] == 1
+
+
+def test_sync_resumes_from_checkpoint(loader, worker):
+    loader.MAX_RETRIES = 0
+    worker.failures[30] = -1
+
+    with pytest.raises(requests.HTTPError):
+        loader.fetch_all_lessons()
+    assert set(json.loads(loader.checkpoint_path.read_text())['batches']) == {'0', '15', '45'}
+    assert not loader.out_path.exists()
+
+    worker.failures.clear()
+    worker.requests.clear()
+    changes = loader.fetch_all_lessons()
+
+    assert worker.requests == Counter({30: 1})
+    assert len(changes['added']) == 3
+
+
+def test_module_split_across_batches(loader, worker):
+    worker.catalogue = {
+        0: {'_count': 1, 'Year 1': {'DRL': {'1.1': {'title': 'One'}, '1.2': {'title': 'Two'}}}},
+        15: {'_count': 1, 'Year 1': {'DRL': {'1.3': {'title': 'Three'}}}},
+    }
+    loader.fetch_all_lessons()
+    hashes = json.loads(loader.hashes_path.read_text())
+    assert hashes['Year 1']['DRL'] == loader.module_hash({'1.1': {'title': 'One'}, '1.2': {'title': 'Two'}, '1.3': {'title': 'Three'}})
+
+    # The first fragment is unchanged, only the second one is sent again
+    worker.catalogue = {
+        0: {'_count': 1, 'Year 1': {'DRL': None}},
+        15: {'_count': 1, 'Year 1': {'DRL': {'1.3': {'title': 'Three, revised'}}}},
+    }
+    changes = loader.fetch_all_lessons()
+
+    assert changes == {'added': [], 'changed': ['Year 1 DRL 1.3 - Three, revised'], 'removed': []}
+    assert list(json.loads(loader.out_path.read_text())['Year 1']['DRL']) == ['1.1', '1.2', '1.3']
+
+
+def test_full_sync_removes_withdrawn_modules(loader, worker):
+    loader.fetch_all_lessons()
+    del worker.catalogue[30]
+    loader.incremental = False
+
+    changes = loader.fetch_all_lessons()
+
+    assert changes['removed'] == ['Year 1 Module 30 1.1 - Lesson 30']
+    assert 'Module 30' not in json.loads(loader.out_path.read_text())['Year 1']
+    assert 'Module 30' not in json.loads(loader.hashes_path.read_text())['Year 1']
+
+
+def test_interrupted_write_keeps_the_old_file(loader, monkeypatch):
+    loader.fetch_all_lessons()
+    before = loader.out_path.read_text()
+
+    def interrupted(data, f, **kwargs):
+        f.write('{"Year 1": ')
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(loader_module.json, 'dump', interrupted)
+    with pytest.raises(KeyboardInterrupt):
+        loader._save_json({'Year 1': {}})
+
+    assert loader.out_path.read_text() == before
+    assert [path.name for path in loader.out_path.parent.iterdir() if path.suffix == '.tmp'] == []